@@ -145,25 +145,26 @@ async def fetch_remote_models(base_url: str, api_key: str, provider_id: str, pro
 
 async def sync_all_provider_models_logic() -> dict:
     """Shared logic for syncing all providers (used by task and API)"""
-    providers = admin_manager.list_providers()
-
     from src.sqlite_repos import ProviderRepo
     provider_repo = ProviderRepo()
 
+    # 同步只读少量字段，走轻量 ProviderRow 而非 admin 的全量 dict 视图
+    providers = provider_repo.list_rows()
+
     # 收集发生变化的 Provider ID
     changed_provider_ids: set[str] = set()
 
     async def process_provider(p):
-        pid = p["id"]
-        pname = p["name"]
-        api_key = p.get("api_key")
-        base_url = p.get("base_url")
+        pid = p.provider_id
+        pname = p.name
+        api_key = p.api_key
+        base_url = p.base_url
 
         # 跳过被禁用的服务站
-        if p.get("enabled") is False:
+        if not p.enabled:
             return (False, False, pid)
 
-        if not p.get("allow_model_update", True):
+        if not p.allow_model_update:
             return (False, False, pid)
 
         if not api_key or not base_url:
@@ -329,6 +330,18 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def provider_cache_middleware(request: Request, call_next):
+    """同一请求内复用已解密的 Provider 记录（见 sqlite_repos 请求级缓存）"""
+    from src.sqlite_repos import begin_request_provider_cache, end_request_provider_cache
+
+    token = begin_request_provider_cache()
+    try:
+        return await call_next(request)
+    finally:
+        end_request_provider_cache(token)
+
+
 @app.get("/")
 async def root():
     return {
@@ -22,7 +22,7 @@ from .constants import (
     AUTH_MAX_LOGIN_ATTEMPTS,
 )
 from .config import get_config
-from .sqlite_repos import get_db_cursor
+from .sqlite_repos import get_db_cursor, get_read_cursor
 from .db import get_db_paths
 
 
@@ -61,7 +61,7 @@ class AdminAuthManager:
 
     def is_initialized(self) -> bool:
         """检查是否已初始化管理员账户"""
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute("SELECT COUNT(*) FROM admin_users WHERE id = 1")
             return cur.fetchone()[0] > 0
 
@@ -88,7 +88,7 @@ class AdminAuthManager:
 
     def verify_credentials(self, password: str) -> bool:
         """验证管理员密码"""
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute("SELECT password_hash FROM admin_users WHERE id = 1")
             row = cur.fetchone()
             if not row:
@@ -47,6 +47,12 @@ LOG_RECENT_LIMIT_DEFAULT: int = 100
 # 小时统计默认天数
 LOG_HOURLY_STATS_DEFAULT_DAYS: int = 7
 
+# 批量日志写入器：后台线程的最长落盘间隔（秒）
+LOG_BATCH_FLUSH_INTERVAL_SECONDS: float = 0.1
+
+# 批量日志写入器：积压达到该条数时立即唤醒落盘
+LOG_BATCH_MAX_PENDING: int = 500
+
 
 # ==================== 代理错误配置 ====================
 
@@ -1,9 +1,14 @@
+import atexit
+import base64
+import os
 import sqlite3
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional, Sequence
 
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 DEFAULT_APP_DB_PATH = "data/app.db"
 DEFAULT_LOGS_DB_PATH = "data/logs.db"
@@ -11,6 +16,21 @@ DEFAULT_LOGS_DB_PATH = "data/logs.db"
 # 模块级 Fernet 实例缓存
 _fernet_instance: Optional[Fernet] = None
 
+# 新写入走 AES-256-GCM（单趟 AEAD，OpenSSL 里吃 AES-NI 加速），
+# 密钥复用 Fernet key 解 base64 后的 32 字节；Fernet 实例保留用于解老密文
+_aesgcm_instance: Optional[AESGCM] = None
+
+# 密文格式版本前缀。Fernet 令牌是 base64 文本（首字节 'g'），
+# 与 \x01 不会冲突，按首字节即可区分新旧格式
+_SECRET_V1_PREFIX = b"\x01"
+_SECRET_NONCE_LEN = 12
+
+# 按 (线程 id, 数据库路径) 缓存的连接池。
+# SQLite 连接只要保证单线程使用即可安全复用，按线程隔离可以避免
+# 每次调用都重新 open 文件、重放 PRAGMA、重读 WAL 头。
+_pool: dict[tuple[int, str], sqlite3.Connection] = {}
+_pool_lock = threading.Lock()
+
 
 @dataclass(frozen=True)
 class DbPaths:
@@ -36,11 +56,12 @@ def init_fernet(key: str) -> None:
     Raises:
         ValueError: 密钥为空或格式无效
     """
-    global _fernet_instance
+    global _fernet_instance, _aesgcm_instance
     if not key:
         raise ValueError("加密密钥不能为空。请设置环境变量 AI_ROUTER_ENCRYPTION_KEY。")
     try:
         _fernet_instance = Fernet(key.encode("utf-8"))
+        _aesgcm_instance = AESGCM(base64.urlsafe_b64decode(key.encode("utf-8")))
     except Exception:
         raise ValueError(
             "加密密钥格式无效。\n"
@@ -66,20 +87,138 @@ def get_fernet() -> Fernet:
     return _fernet_instance
 
 
+def encrypt_secret(plaintext: str) -> bytes:
+    """加密短密文（provider api_key / 网关 api_key）。
+
+    输出格式：版本字节 \\x01 + 12 字节随机 nonce + GCM 密文（含认证标签）。
+    """
+    if _aesgcm_instance is None:
+        raise RuntimeError(
+            "加密尚未初始化。请确保已设置环境变量 AI_ROUTER_ENCRYPTION_KEY。"
+        )
+    nonce = os.urandom(_SECRET_NONCE_LEN)
+    return _SECRET_V1_PREFIX + nonce + _aesgcm_instance.encrypt(
+        nonce, plaintext.encode("utf-8"), None
+    )
+
+
+def decrypt_secret(blob: bytes) -> str:
+    """解密 encrypt_secret 的输出；老的 Fernet 令牌按首字节识别后走兼容路径。
+
+    认证失败时抛 cryptography 的 InvalidTag / InvalidToken，由调用方处理。
+    """
+    blob = bytes(blob)
+    if blob[:1] == _SECRET_V1_PREFIX:
+        if _aesgcm_instance is None:
+            raise RuntimeError(
+                "加密尚未初始化。请确保已设置环境变量 AI_ROUTER_ENCRYPTION_KEY。"
+            )
+        body = blob[1:]
+        return _aesgcm_instance.decrypt(
+            body[:_SECRET_NONCE_LEN], body[_SECRET_NONCE_LEN:], None
+        ).decode("utf-8")
+    return get_fernet().decrypt(blob).decode("utf-8")
+
+
+def get_timezone_offset_hours() -> int:
+    """获取配置的时区偏移（小时），成功后缓存。"""
+    global _tz_offset_hours
+    if _tz_offset_hours is None:
+        from .config import get_config
+        _tz_offset_hours = get_config().timezone_offset
+    return _tz_offset_hours
+
+
+_tz_offset_hours: Optional[int] = None
+
+
+def day_number(timestamp_ms: int) -> int:
+    """毫秒时间戳 → 本地日序号（自 epoch 起的天数，含配置时区偏移）。
+
+    存为整数列后，按天的清理/聚合查询可以走索引范围扫描，
+    不再需要对每行执行 strftime。
+    """
+    return (timestamp_ms + get_timezone_offset_hours() * 3600000) // 86400000
+
+
 def connect_sqlite(path: str) -> sqlite3.Connection:
     _ensure_parent_dir(path)
-    conn = sqlite3.connect(path, check_same_thread=False)
+    # 语句缓存从默认 128 提到 256：热点 SQL 均为模块级常量（字符串对象复用），
+    # 解析/规划结果得以跨调用命中缓存
+    # isolation_level=None：关闭驱动的隐式事务管理，由 get_db_cursor /
+    # get_read_cursor 显式 BEGIN IMMEDIATE / 纯读不开事务
+    conn = sqlite3.connect(
+        path, check_same_thread=False, cached_statements=256, isolation_level=None
+    )
     conn.row_factory = sqlite3.Row
     _apply_pragmas(conn)
     return conn
 
 
+def get_pooled_connection(path: str) -> sqlite3.Connection:
+    """
+    获取当前线程在指定路径上的复用连接，不存在时创建。
+
+    调用方不应 close 返回的连接；进程退出时由 atexit 统一关闭。
+    日志库连接会顺带 ATTACH 应用库（别名 app），使跨库查询
+    （如 tag → key_id 解析）可以用子查询完成而无需第二个连接。
+    """
+    key = (threading.get_ident(), path)
+    conn = _pool.get(key)
+    if conn is None:
+        with _pool_lock:
+            conn = _pool.get(key)
+            if conn is None:
+                _prune_dead_threads_locked()
+                conn = connect_sqlite(path)
+                paths = get_db_paths()
+                if path == paths.logs_db_path:
+                    _ensure_parent_dir(paths.app_db_path)
+                    conn.execute("ATTACH DATABASE ? AS app", (paths.app_db_path,))
+                _pool[key] = conn
+    return conn
+
+
+def _prune_dead_threads_locked() -> None:
+    """回收已退出线程遗留的连接（uvicorn 线程池缩容后不再增长）。
+
+    仅在新建连接的慢路径里调用，且要求调用方已持有 _pool_lock。
+    """
+    alive = {t.ident for t in threading.enumerate()}
+    for key in [k for k in _pool if k[0] not in alive]:
+        try:
+            _pool.pop(key).close()
+        except Exception:
+            pass
+
+
+def close_pooled_connections() -> None:
+    """关闭并清空连接池（进程退出或测试清理时调用）。"""
+    with _pool_lock:
+        for conn in _pool.values():
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _pool.clear()
+
+
+atexit.register(close_pooled_connections)
+
+
 def _apply_pragmas(conn: sqlite3.Connection) -> None:
     statements: Sequence[str] = (
         "PRAGMA journal_mode=WAL;",
         "PRAGMA synchronous=NORMAL;",
         "PRAGMA foreign_keys=ON;",
         "PRAGMA busy_timeout=5000;",
+        # 临时表/排序放内存，页缓存约 64 MB（统计聚合要整表扫 request_logs），
+        # 读路径用 mmap 省一次内核拷贝
+        "PRAGMA temp_store=MEMORY;",
+        "PRAGMA cache_size=-65536;",
+        "PRAGMA mmap_size=268435456;",
+        # WAL 攒到约 1000 页就回写，避免日志高峰把 -wal 文件撑大
+        "PRAGMA wal_autocheckpoint=1000;",
     )
     cur = conn.cursor()
     for stmt in statements:
@@ -87,7 +226,86 @@ def _apply_pragmas(conn: sqlite3.Connection) -> None:
     cur.close()
 
 
+# 自然复合主键且行窄的表用 WITHOUT ROWID 存储：
+# 按主键查/删少走一层 rowid 间接索引，页占用约减半
+_WITHOUT_ROWID_TABLES = (
+    "provider_models",
+    "model_mapping_excluded_providers",
+    "model_mapping_resolved_models",
+    "model_mapping_model_settings",
+)
+
+
+def _prepare_without_rowid_migration(conn: sqlite3.Connection) -> list[str]:
+    """把仍是 rowid 存储的目标表改名为 *_legacy，等 schema 脚本重建后回填。
+
+    需要 legacy_alter_table=ON，否则 RENAME 会连带改写其它表里
+    指向它的外键定义。返回待迁移的表名列表。
+
+    上次启动若在 RENAME 之后、回填落盘之前崩溃，库里会残留 *_legacy 表：
+    这些表也计入返回值，schema 脚本重建目标表后由 _finish 幂等回填。
+    """
+    leftover = [
+        t
+        for t in _WITHOUT_ROWID_TABLES
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (f"{t}_legacy",)
+        ).fetchone()
+    ]
+    fresh = [
+        t
+        for t in _WITHOUT_ROWID_TABLES
+        if t not in leftover
+        and (row := conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (t,)
+        ).fetchone())
+        and "WITHOUT ROWID" not in row[0].upper()
+    ]
+    if not leftover and not fresh:
+        return []
+    # PRAGMA 在事务内是 no-op，必须放在 BEGIN 之前
+    conn.execute("PRAGMA foreign_keys=OFF")
+    conn.execute("PRAGMA legacy_alter_table=ON")
+    if fresh:
+        # isolation_level=None 下每条语句自动提交，RENAME 必须显式包进
+        # 一个事务：中途崩溃则整体回滚，表保持原样，下次启动重走迁移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for t in fresh:
+                for (idx_name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+                    (t,),
+                ).fetchall():
+                    conn.execute(f"DROP INDEX {idx_name}")
+                conn.execute(f"ALTER TABLE {t} RENAME TO {t}_legacy")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    # 保持 _WITHOUT_ROWID_TABLES 的定义顺序：父表（provider_models）先回填
+    return [t for t in _WITHOUT_ROWID_TABLES if t in leftover or t in fresh]
+
+
+def _finish_without_rowid_migration(conn: sqlite3.Connection, pending: list[str]) -> None:
+    if not pending:
+        return
+    for t in pending:
+        # 回填 + 清理按表成对提交：崩溃时 *_legacy 原样保留，
+        # 下次启动被 _prepare 识别为残留重走本步（OR IGNORE 保证幂等）
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"INSERT OR IGNORE INTO {t} SELECT * FROM {t}_legacy")
+            conn.execute(f"DROP TABLE {t}_legacy")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    conn.execute("PRAGMA legacy_alter_table=OFF")
+    conn.execute("PRAGMA foreign_keys=ON")
+
+
 def init_schema_app(conn: sqlite3.Connection) -> None:
+    pending_without_rowid = _prepare_without_rowid_migration(conn)
     conn.executescript(
         """
         CREATE TABLE IF NOT EXISTS admin_users (
@@ -105,8 +323,10 @@ def init_schema_app(conn: sqlite3.Connection) -> None:
           created_at_ms INTEGER NOT NULL,
           enabled INTEGER NOT NULL DEFAULT 1,
           last_used_ms INTEGER,
-          total_requests INTEGER NOT NULL DEFAULT 0
+          total_requests INTEGER NOT NULL DEFAULT 0,
+          key_hash TEXT
         );
+        CREATE INDEX IF NOT EXISTS idx_api_keys_name ON api_keys(name);
 
         CREATE TABLE IF NOT EXISTS providers (
           provider_id TEXT PRIMARY KEY,
@@ -133,7 +353,7 @@ def init_schema_app(conn: sqlite3.Connection) -> None:
           last_activity_type TEXT,
           PRIMARY KEY (provider_id, model_id),
           FOREIGN KEY (provider_id) REFERENCES providers(provider_id) ON DELETE CASCADE
-        );
+        ) WITHOUT ROWID;
         CREATE INDEX IF NOT EXISTS idx_provider_models_last_activity
           ON provider_models(last_activity_ms);
 
@@ -144,6 +364,7 @@ def init_schema_app(conn: sqlite3.Connection) -> None:
           latency_ms REAL,
           error TEXT,
           tested_at_ms INTEGER NOT NULL,
+          tested_at_iso TEXT,
           response_body_json TEXT,
           PRIMARY KEY (provider_id, model_id),
           FOREIGN KEY (provider_id, model_id)
@@ -187,7 +408,7 @@ def init_schema_app(conn: sqlite3.Connection) -> None:
           provider_id TEXT NOT NULL,
           PRIMARY KEY (unified_name, provider_id),
           FOREIGN KEY (unified_name) REFERENCES model_mappings(unified_name) ON DELETE CASCADE ON UPDATE CASCADE
-        );
+        ) WITHOUT ROWID;
 
         CREATE TABLE IF NOT EXISTS model_mapping_resolved_models (
           unified_name TEXT NOT NULL,
@@ -196,7 +417,7 @@ def init_schema_app(conn: sqlite3.Connection) -> None:
           PRIMARY KEY (unified_name, provider_id, model_id),
           FOREIGN KEY (unified_name) REFERENCES model_mappings(unified_name) ON DELETE CASCADE ON UPDATE CASCADE,
           FOREIGN KEY (provider_id, model_id) REFERENCES provider_models(provider_id, model_id) ON DELETE CASCADE
-        );
+        ) WITHOUT ROWID;
         CREATE INDEX IF NOT EXISTS idx_mapping_resolved_unified
           ON model_mapping_resolved_models(unified_name);
 
@@ -209,7 +430,7 @@ def init_schema_app(conn: sqlite3.Connection) -> None:
           PRIMARY KEY (unified_name, provider_id, model_id),
           FOREIGN KEY (unified_name) REFERENCES model_mappings(unified_name) ON DELETE CASCADE ON UPDATE CASCADE,
           FOREIGN KEY (provider_id, model_id) REFERENCES provider_models(provider_id, model_id) ON DELETE CASCADE
-        );
+        ) WITHOUT ROWID;
 
         CREATE TABLE IF NOT EXISTS model_mapping_sync_config (
           id INTEGER PRIMARY KEY CHECK (id = 1),
@@ -221,10 +442,39 @@ def init_schema_app(conn: sqlite3.Connection) -> None:
         INSERT OR IGNORE INTO model_mapping_sync_config (id) VALUES (1);
         """
     )
+    _finish_without_rowid_migration(conn, pending_without_rowid)
+    # 写入时物化的 ISO 时间串；老行留 NULL，读取时回退换算
+    _ensure_column(conn, "model_health_last", "tested_at_iso", "TEXT")
+    # 密钥 SHA-256 摘要，验证走索引等值查询；老行留 NULL，首次验证命中后回填
+    _ensure_column(conn, "api_keys", "key_hash", "TEXT")
+    # 部分索引只收启用行：validate_and_touch 的 key_hash = ? AND enabled = 1
+    # 在更小的树上做探查，禁用行根本不进索引
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_api_keys_hash_enabled"
+        " ON api_keys(key_hash) WHERE enabled = 1"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_providers_enabled_name"
+        " ON providers(name) WHERE enabled = 1"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_api_keys_hash")
     conn.commit()
 
 
+def _ensure_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    """日志库启用 auto_vacuum=INCREMENTAL（需要 VACUUM 重建一次才生效）。
+
+    之后保留期清理释放的页可以用 PRAGMA incremental_vacuum 分批
+    归还文件系统，数据库文件不再只增不减。
+    """
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+
 def init_schema_logs(conn: sqlite3.Connection) -> None:
+    _ensure_incremental_vacuum(conn)
     conn.executescript(
         """
         CREATE TABLE IF NOT EXISTS request_logs (
@@ -246,10 +496,16 @@ def init_schema_logs(conn: sqlite3.Connection) -> None:
           actual_model TEXT,
           prompt_tokens INTEGER,
           completion_tokens INTEGER,
-          total_tokens INTEGER
+          total_tokens INTEGER,
+          day INTEGER
         );
 
         CREATE INDEX IF NOT EXISTS idx_logs_ts ON request_logs(timestamp_ms);
+        -- 覆盖 get_stats/get_daily_stats 的范围过滤 + GROUP BY，聚合可走 index-only 扫描
+        CREATE INDEX IF NOT EXISTS idx_logs_ts_prov_model
+          ON request_logs(timestamp_ms, provider_id, unified_model, status_code, total_tokens);
+        CREATE INDEX IF NOT EXISTS idx_logs_type_ts ON request_logs(type, timestamp_ms);
+        CREATE INDEX IF NOT EXISTS idx_logs_level_ts ON request_logs(level, timestamp_ms);
         CREATE INDEX IF NOT EXISTS idx_logs_api_key_ts ON request_logs(api_key_id, timestamp_ms);
         CREATE INDEX IF NOT EXISTS idx_logs_provider_ts ON request_logs(provider_id, timestamp_ms);
         CREATE INDEX IF NOT EXISTS idx_logs_unified_model_ts ON request_logs(unified_model, timestamp_ms);
@@ -263,17 +519,118 @@ def init_schema_logs(conn: sqlite3.Connection) -> None:
           message TEXT,
           error TEXT,
           provider_id TEXT,
+          provider_name TEXT,
           model TEXT,
           actual_model TEXT,
           client_ip TEXT,
           status_code INTEGER,
-          duration_ms REAL
+          duration_ms REAL,
+          day INTEGER
         );
 
         CREATE INDEX IF NOT EXISTS idx_event_logs_ts ON event_logs(timestamp_ms);
         CREATE INDEX IF NOT EXISTS idx_event_logs_type_ts ON event_logs(type, timestamp_ms);
+        CREATE INDEX IF NOT EXISTS idx_event_logs_level_ts ON event_logs(level, timestamp_ms);
+        """
+    )
+    conn.commit()
+    _migrate_logs_schema(conn)
+    _init_logs_fts(conn)
+
+
+# None = 尚未探测；init_schema_logs 建表时或 fts5_available 首次调用时置值
+_fts5_available: Optional[bool] = None
+
+
+def fts5_available() -> bool:
+    """日志库的 FTS5 虚拟表是否可用（不可用时关键字搜索退回 LIKE）。
+
+    schema 初始化可能跑在独立进程里（scripts/init_db.py），服务进程
+    不会经过 init_schema_logs，因此首次调用时按 sqlite_master 里有没有
+    FTS 表惰性探测一次并缓存结果。
+    """
+    global _fts5_available
+    if _fts5_available is None:
+        try:
+            conn = get_pooled_connection(get_db_paths().logs_db_path)
+            _fts5_available = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='request_logs_fts'"
+            ).fetchone() is not None
+        except sqlite3.Error:
+            # 探测失败不缓存，下次调用重试
+            return False
+    return _fts5_available
+
+
+def _create_content_fts(conn: sqlite3.Connection, table: str, columns: Sequence[str]) -> None:
+    """为 table 建 external-content FTS5 表（{table}_fts）及同步触发器。"""
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new_cols = ", ".join(f"new.{c}" for c in columns)
+    old_cols = ", ".join(f"old.{c}" for c in columns)
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)
+    ).fetchone()
+    conn.executescript(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+          {cols},
+          content='{table}', content_rowid='rowid'
+        );
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+          INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END;
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+          INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+        END;
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+          INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+          INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END;
         """
     )
+    if not existed:
+        # 首次建表时为存量行重建索引
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")
+
+
+def _init_logs_fts(conn: sqlite3.Connection) -> None:
+    """为 request_logs / event_logs 建立 FTS5 外部内容索引及同步触发器。"""
+    global _fts5_available
+    try:
+        _create_content_fts(conn, "request_logs", ("message", "unified_model", "actual_model", "error"))
+        _create_content_fts(conn, "event_logs", ("message", "model", "actual_model", "error"))
+        conn.commit()
+        _fts5_available = True
+    except sqlite3.OperationalError as e:
+        print(f"[DB] FTS5 不可用，关键字搜索将退回 LIKE 扫描: {e}")
+        _fts5_available = False
+
+
+def _ensure_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> bool:
+    """为已存在的表补充列（老库迁移）。返回是否新增。"""
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column in cols:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+
+def _migrate_logs_schema(conn: sqlite3.Connection) -> None:
+    try:
+        offset = get_timezone_offset_hours()
+    except Exception:
+        offset = 8
+    for table in ("request_logs", "event_logs"):
+        _ensure_column(conn, table, "day", "INTEGER")
+        conn.execute(
+            f"UPDATE {table} SET day = (timestamp_ms + ? * 3600000) / 86400000 WHERE day IS NULL",
+            (offset,),
+        )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_day ON request_logs(day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_event_logs_day ON event_logs(day)")
+    # 写入时冗余的 provider 名称；老行留 NULL，读取时回退 join 解析
+    _ensure_column(conn, "event_logs", "provider_name", "TEXT")
     conn.commit()
 
 
@@ -230,6 +230,7 @@ class LogManager:
                 "message": log_entry.message,
                 "error": log_entry.error,
                 "provider_id": log_entry.provider_id,
+                "provider_name": log_entry.provider,
                 "model": log_entry.model,
                 "actual_model": log_entry.actual_model,
                 "client_ip": log_entry.client_ip,
@@ -23,8 +23,9 @@ class ModelHealthResult:
     latency_ms: float       # 响应延迟（毫秒）
     response_body: dict     # 完整响应体JSON
     error: Optional[str]    # 错误信息（如果失败）
-    tested_at: str          # ISO8601 时间戳
-    
+    tested_at: str          # ISO8601 时间戳（展示用）
+    tested_at_ms: int = 0   # 毫秒时间戳（入库用，与 tested_at 同一次取钟）
+
     def to_dict(self) -> dict:
         return asdict(self)
     
@@ -37,14 +38,24 @@ class ModelHealthResult:
             latency_ms=data.get("latency_ms", 0.0),
             response_body=data.get("response_body", {}),
             error=data.get("error"),
-            tested_at=data.get("tested_at", "")
+            tested_at=data.get("tested_at", ""),
+            tested_at_ms=data.get("tested_at_ms", 0)
         )
-    
+
     @staticmethod
     def make_key(provider_id: str, model: str) -> str:
         return f"{provider_id}:{model}"
 
 
+def _now_stamp() -> dict[str, Any]:
+    """一次取钟，同时生成 ISO 串（展示用）和毫秒整数（入库用，免二次解析）"""
+    now = datetime.now(timezone.utc)
+    return {
+        "tested_at": now.isoformat(),
+        "tested_at_ms": int(now.timestamp() * 1000),
+    }
+
+
 class ModelHealthManager:
     """
     模型健康检测管理器 (SQLite)
@@ -99,7 +110,7 @@ class ModelHealthManager:
             latency_ms=latency_ms,
             response_body=response_body if not success and response_body else {},
             error=error,
-            tested_at=datetime.now(timezone.utc).isoformat()
+            **_now_stamp()
         )
         
         key = ModelHealthResult.make_key(provider_id, model)
@@ -208,7 +219,7 @@ class ModelHealthManager:
                         latency_ms=latency_ms,
                         response_body={},
                         error=None,
-                        tested_at=datetime.now(timezone.utc).isoformat()
+                        **_now_stamp()
                     )
                 else:
                     error_detail = json.dumps(response_body, ensure_ascii=False).replace('\n', ' ')
@@ -220,7 +231,7 @@ class ModelHealthManager:
                         latency_ms=latency_ms,
                         response_body=response_body,
                         error=full_error,
-                        tested_at=datetime.now(timezone.utc).isoformat()
+                        **_now_stamp()
                     )
         except httpx.TimeoutException:
             # 超时异常 - 错误信息包含 timeout 关键字以便熔断逻辑识别
@@ -232,7 +243,7 @@ class ModelHealthManager:
                 latency_ms=latency_ms,
                 response_body={},
                 error="timeout",
-                tested_at=datetime.now(timezone.utc).isoformat()
+                **_now_stamp()
             )
         except httpx.RequestError as e:
             # 网络/连接错误 - 错误信息包含 network 关键字以便熔断逻辑识别
@@ -245,7 +256,7 @@ class ModelHealthManager:
                 latency_ms=latency_ms,
                 response_body={},
                 error=f"network error: {error_msg}",
-                tested_at=datetime.now(timezone.utc).isoformat()
+                **_now_stamp()
             )
         except Exception as e:
             latency_ms = (time.time() - start_time) * 1000
@@ -256,7 +267,7 @@ class ModelHealthManager:
                 latency_ms=latency_ms,
                 response_body={},
                 error=str(e),
-                tested_at=datetime.now(timezone.utc).isoformat()
+                **_now_stamp()
             )
         
         # Save
@@ -288,7 +299,7 @@ class ModelHealthManager:
             latency_ms=0.0,
             response_body={},
             error=error,
-            tested_at=datetime.now(timezone.utc).isoformat()
+            **_now_stamp()
         )
 
     def _create_skipped_result(self, provider_id: str, model: str) -> ModelHealthResult:
@@ -300,7 +311,7 @@ class ModelHealthManager:
             response_body={},
             error=None, # Skipped is not error? Original code had error=None but success=False?
             # Original: success=False, error=None -> implies skipped/unknown.
-            tested_at=datetime.now(timezone.utc).isoformat()
+            **_now_stamp()
         )
 
     async def test_mapping_models(
@@ -1,37 +1,303 @@
+import atexit
+import copy
+import hashlib
 import json
+import sqlite3
+import threading
 import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from functools import lru_cache
 from datetime import datetime, timezone, timedelta
 from dataclasses import dataclass
-from typing import Any, Optional, Dict, List, Generator
+from typing import Any, Callable, Optional, Dict, List, Generator
 
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import InvalidToken
 
-from .db import connect_sqlite, get_db_paths, get_fernet
-from .constants import PROXY_ERROR_MESSAGE_MAX_LENGTH
+from .db import (
+    get_pooled_connection,
+    get_db_paths,
+    encrypt_secret,
+    decrypt_secret,
+    day_number,
+    fts5_available,
+)
+from .constants import (
+    LOG_BATCH_FLUSH_INTERVAL_SECONDS,
+    LOG_BATCH_MAX_PENDING,
+    PROXY_ERROR_MESSAGE_MAX_LENGTH,
+)
+
+
+# JSON 编解码：装了 orjson（可选依赖）就用它的 C 实现，
+# 健康检查 response_body 这类较大对象能快 5-10x；否则退回标准库
+try:
+    import orjson
+
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    _json_loads = json.loads
 
 
 def _now_ms() -> int:
     return int(time.time() * 1000)
 
 
+def _fts_match_query(keyword: str) -> str:
+    """用户关键字 → FTS5 前缀短语查询（双引号转义，避免被当作语法）。"""
+    return '"' + keyword.replace('"', '""') + '"*'
+
+
+@lru_cache(maxsize=1)
+def _config_tz() -> timezone:
+    """配置时区对象，进程内只构建一次（配置运行期不变）。"""
+    from .db import get_timezone_offset_hours
+    return timezone(timedelta(hours=get_timezone_offset_hours()))
+
+
+def _format_ts(seconds: float) -> str:
+    """秒级时间戳 → 'YYYY-MM-DD HH:MM:SS'（配置时区，免去每次 libc 时区查询）。"""
+    return datetime.fromtimestamp(seconds, _config_tz()).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# 请求级 Provider 缓存：HTTP 中间件在请求开始时放入空 dict，
+# 同一请求内（路由 + 健康检查 + 日志补全）重复的 get_by_id
+# 命中 dict，免去再次查询 + Fernet 解密；请求结束后整体丢弃
+_request_provider_cache: ContextVar[Optional[dict]] = ContextVar(
+    "request_provider_cache", default=None
+)
+
+
+def begin_request_provider_cache() -> Token:
+    """请求开始时调用，开启本请求的 Provider 缓存。"""
+    return _request_provider_cache.set({})
+
+
+def end_request_provider_cache(token: Token) -> None:
+    """请求结束时调用，丢弃本请求的 Provider 缓存。"""
+    _request_provider_cache.reset(token)
+
+
 @contextmanager
 def get_db_cursor(db_path: str) -> Generator[Any, None, None]:
-    """Context manager for SQLite database connection and cursor."""
-    conn = connect_sqlite(db_path)
+    """Context manager for SQLite database connection and cursor (write path).
+
+    The underlying connection is pooled per-thread (see db.get_pooled_connection)
+    and must not be closed here. 连接以 isolation_level=None 打开，这里显式
+    BEGIN IMMEDIATE：一进事务就拿写锁，避免 deferred 事务升级时的 busy 重试。
+    """
+    conn = get_pooled_connection(db_path)
+    cur = conn.cursor()
     try:
-        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
         yield cur
         conn.commit()
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        cur.close()
+
+
+@contextmanager
+def get_read_cursor(db_path: str) -> Generator[Any, None, None]:
+    """同 get_db_cursor，但纯读：不开事务、不 commit。
+
+    WAL 下读者拿快照即可，省掉每次查询的 BEGIN/COMMIT 往返；
+    也因此可以在未关闭的读游标内安全地嵌套其它读写调用。
+    """
+    conn = get_pooled_connection(db_path)
+    cur = conn.cursor()
+    try:
+        yield cur
+    finally:
+        cur.close()
+
+
+class _BatchLogWriter:
+    """后台批量日志写入器。
 
+    insert 路径只做入队（deque.append，无锁），由守护线程定期醒来，
+    用一次 executemany + 一次 commit 落盘整批日志，把每行一次 fsync
+    摊薄为每批一次。flush() 可在任意线程同步调用（读取前、进程退出时）。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        insert_sql: str,
+        flush_interval: float = LOG_BATCH_FLUSH_INTERVAL_SECONDS,
+        max_pending: int = LOG_BATCH_MAX_PENDING,
+        on_flush: Optional[Callable[[], None]] = None,
+    ):
+        self._db_path = db_path
+        self._insert_sql = insert_sql
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._on_flush = on_flush
+        self._queue: deque = deque()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def append(self, row: tuple) -> None:
+        self._queue.append(row)
+        if len(self._queue) >= self._max_pending:
+            self._wakeup.set()
+        if self._thread is None or not self._thread.is_alive():
+            self._ensure_thread()
+
+    def _ensure_thread(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name="log-batch-writer"
+                )
+                self._thread.start()
 
-@dataclass(frozen=True)
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[LOG-WRITER] Flush failed: {e}")
+
+    def flush(self) -> None:
+        """将当前积压的日志一次性写入数据库。"""
+        with self._flush_lock:
+            queue = self._queue
+            batch = []
+            while queue:
+                try:
+                    batch.append(queue.popleft())
+                except IndexError:
+                    break
+            if not batch:
+                return
+            with get_db_cursor(self._db_path) as cur:
+                cur.executemany(self._insert_sql, batch)
+            if self._on_flush is not None:
+                self._on_flush()
+
+
+_RECENT_LOGS_SELECT = (
+    "SELECT id, timestamp_ms, level, type, method, path, protocol,"
+    " status_code, duration_ms, message, error, client_ip,"
+    " api_key_id, provider_id, unified_model, actual_model,"
+    " prompt_tokens, completion_tokens, total_tokens"
+    " FROM request_logs WHERE 1=1"
+)
+
+
+@lru_cache(maxsize=64)
+def _recent_logs_query(has_level: bool, has_provider: bool, keyword_mode: str, n_matched_providers: int) -> str:
+    """get_recent 的 SQL 模板，按过滤器形状缓存。
+
+    过滤组合有限（level/provider/关键字模式 × 命中 provider 数），
+    对同一形状复用同一份查询文本，命中 sqlite 连接内建的
+    prepared-statement 缓存，省掉重复的 prepare。
+    keyword_mode: ""（无关键字）/ "fts" / "like"。
+    """
+    query = _RECENT_LOGS_SELECT
+    if has_level:
+        query += " AND level = ?"
+    if has_provider:
+        query += " AND provider_id = ?"
+    if keyword_mode:
+        if keyword_mode == "fts":
+            conditions = [
+                "rowid IN (SELECT rowid FROM request_logs_fts WHERE request_logs_fts MATCH ?)"
+            ]
+        else:
+            conditions = ["message LIKE ?", "unified_model LIKE ?", "actual_model LIKE ?", "error LIKE ?"]
+        if n_matched_providers:
+            placeholders = ",".join("?" for _ in range(n_matched_providers))
+            conditions.append(f"provider_id IN ({placeholders})")
+        query += f" AND ({' OR '.join(conditions)})"
+    return query + " ORDER BY timestamp_ms DESC LIMIT ?"
+
+
+@lru_cache(maxsize=8)
+def _stats_queries(has_date: bool, has_tag: bool) -> tuple[str, str, str]:
+    """get_stats 的 (总量, 分组, 小时) 三条 SQL 模板，按过滤形状缓存。
+
+    形状只有 2×2 种，缓存后运行期零字符串拼接，
+    且同形状请求复用同一字符串对象（命中 prepared-statement 缓存）。
+    """
+    where_clauses = ["1=1"]
+    if has_date:
+        where_clauses.append("timestamp_ms >= ? AND timestamp_ms < ?")
+    if has_tag:
+        # 日志库连接已 ATTACH 应用库（见 db.get_pooled_connection）；
+        # tag 不存在时子查询返回 NULL，等价于原先的 1=0
+        where_clauses.append("api_key_id = (SELECT key_id FROM app.api_keys WHERE name = ?)")
+    where_sql = " AND ".join(where_clauses)
+
+    totals_sql = f"""
+        SELECT COUNT(*),
+               SUM(CASE WHEN status_code = 200 THEN 1 ELSE 0 END),
+               COALESCE(SUM(total_tokens), 0)
+        FROM request_logs
+        WHERE {where_sql}
+    """
+    grouped_sql = f"""
+        SELECT provider_id,
+               json_group_object(
+                 unified_model,
+                 json_object('total', total, 'successful', success,
+                             'failed', total - success, 'tokens', tokens)
+               )
+        FROM (
+          SELECT provider_id, unified_model,
+                 COUNT(*) AS total,
+                 SUM(CASE WHEN status_code = 200 THEN 1 ELSE 0 END) AS success,
+                 COALESCE(SUM(total_tokens), 0) AS tokens
+          FROM request_logs
+          WHERE {where_sql}
+            AND provider_id IS NOT NULL AND unified_model IS NOT NULL
+          GROUP BY provider_id, unified_model
+        )
+        GROUP BY provider_id
+    """
+    hourly_sql = (
+        "SELECT strftime('%H', timestamp_ms / 1000, 'unixepoch', 'localtime') as hour,"
+        f" COUNT(*) FROM request_logs WHERE {where_sql} GROUP BY hour"
+    )
+    return totals_sql, grouped_sql, hourly_sql
+
+
+_INSERT_REQUEST_LOG_SQL = """
+    INSERT OR REPLACE INTO request_logs (
+      id, timestamp_ms, level, type, method, path, protocol,
+      status_code, duration_ms, message, error, client_ip,
+      api_key_id, provider_id, unified_model, actual_model,
+      prompt_tokens, completion_tokens, total_tokens, day
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+@dataclass(frozen=True, slots=True)
 class ProviderRow:
+    """providers 表一行的轻量只读视图。
+
+    相比 12 键 dict，slots 数据类省掉了每行一个哈希表的开销，
+    属性访问也更快；只读少量字段的内部调用方优先用它
+    （list_rows/get_row），需要 JSON 序列化的仍走 dict 接口。
+    """
+
     provider_id: str
     name: str
     base_url: str
@@ -42,15 +308,70 @@ class ProviderRow:
     allow_health_check: bool
     allow_model_update: bool
     default_protocol: Optional[str]
+    models_updated_at_ms: Optional[int]
+
+
+# Provider id↔name 双向映射缓存：(构建时的版本号, id→name, name→id)。
+# 日志补全等路径每个请求都要查一到两次，providers 表又极少变动；
+# 写路径（upsert/delete）递增版本号，读路径版本不符才重建——
+# O(1) 整数比较即可判断新鲜度，不需要 TTL 定时失效
+_provider_maps_cache: Optional[tuple[int, dict[str, str], dict[str, str]]] = None
+_provider_maps_version: int = 0
+
+
+# AES/GCM 在 OpenSSL 里执行时释放 GIL，provider 较多时并行解密能叠加核数；
+# 行少时线程调度反而亏，低于阈值走顺序路径。线程池按需建线程，闲置无开销
+_DECRYPT_PARALLEL_THRESHOLD = 8
+_decrypt_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="secret-decrypt")
 
 
 class ProviderRepo:
     def __init__(self):
         self._paths = get_db_paths()
 
+    @staticmethod
+    def _decrypt_api_key(api_key_enc: bytes) -> str:
+        try:
+            return decrypt_secret(api_key_enc)
+        except (InvalidToken, InvalidTag):
+            raise RuntimeError("Failed to decrypt providers.api_key_enc. Check AI_ROUTER_ENCRYPTION_KEY environment variable.")
+
+    @staticmethod
+    def _row_to_provider_row(r, api_key: str) -> ProviderRow:
+        return ProviderRow(
+            provider_id=r["provider_id"],
+            name=r["name"],
+            base_url=r["base_url"],
+            api_key=api_key,
+            weight=r["weight"],
+            timeout_ms=r["timeout_ms"],
+            enabled=r["enabled"] != 0,
+            allow_health_check=r["allow_health_check"] != 0,
+            allow_model_update=r["allow_model_update"] != 0,
+            default_protocol=r["default_protocol"],
+            models_updated_at_ms=r["models_updated_at_ms"],
+        )
+
+    @staticmethod
+    def _row_to_dict(r, api_key: str) -> dict:
+        # 列类型由 schema 保证，无需再套 int()/float()；布尔列用 != 0 转换
+        timeout_ms = r["timeout_ms"]
+        return {
+            "id": r["provider_id"],
+            "name": r["name"],
+            "base_url": r["base_url"],
+            "api_key": api_key,
+            "weight": r["weight"],
+            "timeout": timeout_ms / 1000.0 if timeout_ms is not None else None,
+            "enabled": r["enabled"] != 0,
+            "allow_health_check": r["allow_health_check"] != 0,
+            "allow_model_update": r["allow_model_update"] != 0,
+            "default_protocol": r["default_protocol"],
+            "models_updated_at": r["models_updated_at_ms"],
+        }
+
     def list(self) -> list[dict]:
-        fernet = get_fernet()
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute(
                 """
                 SELECT provider_id, name, base_url, api_key_enc, weight, timeout_ms,
@@ -62,32 +383,57 @@ class ProviderRepo:
             )
             rows = cur.fetchall()
 
-        providers: list[dict] = []
-        for r in rows:
-            try:
-                api_key = fernet.decrypt(r["api_key_enc"]).decode("utf-8")
-            except InvalidToken:
-                raise RuntimeError("Failed to decrypt providers.api_key_enc. Check AI_ROUTER_ENCRYPTION_KEY environment variable.")
-            providers.append(
-                {
-                    "id": r["provider_id"],
-                    "name": r["name"],
-                    "base_url": r["base_url"],
-                    "api_key": api_key,
-                    "weight": int(r["weight"]),
-                    "timeout": (float(r["timeout_ms"]) / 1000.0) if r["timeout_ms"] is not None else None,
-                    "enabled": bool(r["enabled"]),
-                    "allow_health_check": bool(r["allow_health_check"]),
-                    "allow_model_update": bool(r["allow_model_update"]),
-                    "default_protocol": r["default_protocol"],
-                    "models_updated_at": r["models_updated_at_ms"],
-                }
+        api_keys = self._decrypt_batch([r["api_key_enc"] for r in rows])
+        return [self._row_to_dict(r, k) for r, k in zip(rows, api_keys)]
+
+    @classmethod
+    def _decrypt_batch(cls, blobs: List[bytes]) -> List[str]:
+        if len(blobs) < _DECRYPT_PARALLEL_THRESHOLD:
+            return [cls._decrypt_api_key(b) for b in blobs]
+        return list(_decrypt_executor.map(cls._decrypt_api_key, blobs))
+
+    def list_rows(self) -> List[ProviderRow]:
+        """同 list()，但返回 slots 数据类，供只读内部调用方使用。"""
+        with get_read_cursor(self._paths.app_db_path) as cur:
+            cur.execute(
+                """
+                SELECT provider_id, name, base_url, api_key_enc, weight, timeout_ms,
+                       enabled, allow_health_check, allow_model_update, default_protocol,
+                       models_updated_at_ms
+                FROM providers
+                ORDER BY name
+                """
             )
-        return providers
+            rows = cur.fetchall()
+        api_keys = self._decrypt_batch([r["api_key_enc"] for r in rows])
+        return [self._row_to_provider_row(r, k) for r, k in zip(rows, api_keys)]
+
+    def get_row(self, provider_id: str) -> Optional[ProviderRow]:
+        """同 get_by_id()，但返回 slots 数据类（不经过请求级缓存）。"""
+        with get_read_cursor(self._paths.app_db_path) as cur:
+            cur.execute(
+                """
+                SELECT provider_id, name, base_url, api_key_enc, weight, timeout_ms,
+                       enabled, allow_health_check, allow_model_update, default_protocol,
+                       models_updated_at_ms
+                FROM providers
+                WHERE provider_id = ?
+                """,
+                (provider_id,),
+            )
+            r = cur.fetchone()
+        if not r:
+            return None
+        return self._row_to_provider_row(r, self._decrypt_api_key(r["api_key_enc"]))
 
     def get_by_id(self, provider_id: str) -> Optional[dict]:
-        fernet = get_fernet()
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        cache = _request_provider_cache.get()
+        if cache is not None and provider_id in cache:
+            cached = cache[provider_id]
+            # 浅拷贝，避免调用方就地修改污染缓存
+            return dict(cached) if cached is not None else None
+
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute(
                 """
                 SELECT provider_id, name, base_url, api_key_enc, weight, timeout_ms,
@@ -99,41 +445,48 @@ class ProviderRepo:
                 (provider_id,),
             )
             r = cur.fetchone()
-        
+
         if not r:
+            if cache is not None:
+                cache[provider_id] = None
             return None
-        try:
-            api_key = fernet.decrypt(r["api_key_enc"]).decode("utf-8")
-        except InvalidToken:
-            raise RuntimeError("Failed to decrypt providers.api_key_enc. Check AI_ROUTER_ENCRYPTION_KEY environment variable.")
-        return {
-            "id": r["provider_id"],
-            "name": r["name"],
-            "base_url": r["base_url"],
-            "api_key": api_key,
-            "weight": int(r["weight"]),
-            "timeout": (float(r["timeout_ms"]) / 1000.0) if r["timeout_ms"] is not None else None,
-            "enabled": bool(r["enabled"]),
-            "allow_health_check": bool(r["allow_health_check"]),
-            "allow_model_update": bool(r["allow_model_update"]),
-            "default_protocol": r["default_protocol"],
-            "models_updated_at": r["models_updated_at_ms"],
-        }
+        api_key = self._decrypt_api_key(r["api_key_enc"])
+        result = self._row_to_dict(r, api_key)
+        if cache is not None:
+            cache[provider_id] = dict(result)
+        return result
 
-    def get_id_name_map(self) -> dict[str, str]:
-        with get_db_cursor(self._paths.app_db_path) as cur:
+    def get_maps(self) -> tuple[dict[str, str], dict[str, str]]:
+        """一次查询同时构建 id→name 与 name→id 映射（返回值视作只读）。"""
+        global _provider_maps_cache
+        cached = _provider_maps_cache
+        version = _provider_maps_version
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute("SELECT provider_id, name FROM providers")
             rows = cur.fetchall()
-        return {r["provider_id"]: r["name"] for r in rows if r["provider_id"]}
+        id_name_map: dict[str, str] = {}
+        name_id_map: dict[str, str] = {}
+        for r in rows:
+            pid = r["provider_id"]
+            name = r["name"]
+            if pid:
+                id_name_map[pid] = name
+            if name:
+                name_id_map[name] = pid
+        _provider_maps_cache = (version, id_name_map, name_id_map)
+        return id_name_map, name_id_map
+
+    def get_id_name_map(self) -> dict[str, str]:
+        return self.get_maps()[0]
 
     def get_name_id_map(self) -> dict[str, str]:
-        with get_db_cursor(self._paths.app_db_path) as cur:
-            cur.execute("SELECT provider_id, name FROM providers")
-            rows = cur.fetchall()
-        return {r["name"]: r["provider_id"] for r in rows if r["name"]}
+        return self.get_maps()[1]
 
     def get_protocols(self) -> dict[str, Optional[str]]:
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute("SELECT provider_id, default_protocol FROM providers")
             rows = cur.fetchall()
         return {r["provider_id"]: r["default_protocol"] for r in rows if r["provider_id"]}
@@ -154,8 +507,7 @@ class ProviderRepo:
         allow_model_update = 1 if provider.get("allow_model_update", True) else 0
         default_protocol = provider.get("default_protocol")
 
-        fernet = get_fernet()
-        api_key_enc = fernet.encrypt(api_key.encode("utf-8"))
+        api_key_enc = encrypt_secret(api_key)
 
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute(
@@ -193,10 +545,21 @@ class ProviderRepo:
                 ),
             )
 
+        global _provider_maps_version
+        _provider_maps_version += 1
+        cache = _request_provider_cache.get()
+        if cache is not None:
+            cache.pop(provider_id, None)
+
     def delete(self, provider_id: str) -> bool:
+        global _provider_maps_version
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute("DELETE FROM providers WHERE provider_id = ?", (provider_id,))
             deleted = cur.rowcount > 0
+        _provider_maps_version += 1
+        cache = _request_provider_cache.get()
+        if cache is not None:
+            cache.pop(provider_id, None)
         return deleted
 
     def update_models_updated_at(self, provider_id: str) -> None:
@@ -207,19 +570,58 @@ class ProviderRepo:
             )
 
 
+# 模块级共享实例：ProviderRepo 自身无可变状态，跨线程复用安全
+_provider_repo_singleton: Optional[ProviderRepo] = None
+
+
+def _provider_repo() -> ProviderRepo:
+    global _provider_repo_singleton
+    if _provider_repo_singleton is None:
+        _provider_repo_singleton = ProviderRepo()
+    return _provider_repo_singleton
+
+
+@lru_cache(maxsize=4096)
+def _key_hash(full_key: str) -> str:
+    """密钥的 SHA-256 摘要，用于 api_keys.key_hash 索引等值验证。
+
+    同一批密钥会被反复验证，进程内按原文缓存摘要，热身后命中率接近 100%。
+    """
+    return hashlib.sha256(full_key.encode("utf-8")).hexdigest()
+
+
+# RETURNING 需要 SQLite >= 3.35；老发行版（如 RHEL 8 的 3.26）
+# 退回 SELECT + UPDATE 两条语句
+_RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# 验证走单条 UPDATE ... RETURNING：一次索引探查同时完成校验与计数更新
+_VALIDATE_TOUCH_SQL = """
+UPDATE api_keys
+SET last_used_ms = ?, total_requests = total_requests + 1
+WHERE key_hash = ? AND enabled = 1
+RETURNING key_id, name
+"""
+
+_VALIDATE_SELECT_SQL = "SELECT key_id, name FROM api_keys WHERE key_hash = ? AND enabled = 1"
+
+_VALIDATE_TOUCH_FALLBACK_SQL = """
+UPDATE api_keys
+SET last_used_ms = ?, total_requests = total_requests + 1
+WHERE key_id = ?
+"""
+
+
 class ApiKeyRepo:
     def __init__(self):
         self._paths = get_db_paths()
 
     def _decrypt_key(self, key_enc: bytes) -> str:
-        """解密密钥"""
-        fernet = get_fernet()
-        return fernet.decrypt(key_enc).decode("utf-8")
+        """解密密钥（新 AES-GCM 格式或旧 Fernet 令牌）"""
+        return decrypt_secret(key_enc)
 
     def _encrypt_key(self, full_key: str) -> bytes:
         """加密密钥"""
-        fernet = get_fernet()
-        return fernet.encrypt(full_key.encode("utf-8"))
+        return encrypt_secret(full_key)
 
     def _make_masked(self, full_key: str) -> str:
         """生成掩码格式的密钥"""
@@ -237,9 +639,9 @@ class ApiKeyRepo:
             "key_masked": self._make_masked(full_key),
             "name": r["name"],
             "created_at": created_at,
-            "created_at_str": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created_at)),
+            "created_at_str": _format_ts(created_at),
             "last_used": last_used,
-            "last_used_str": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_used)) if last_used else None,
+            "last_used_str": _format_ts(last_used) if last_used else None,
             "enabled": bool(r["enabled"]),
             "total_requests": int(r["total_requests"]),
         }
@@ -248,7 +650,7 @@ class ApiKeyRepo:
         return result
 
     def list(self) -> list[dict]:
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute(
                 """
                 SELECT key_id, key_enc, name, created_at_ms, last_used_ms, enabled, total_requests
@@ -260,7 +662,7 @@ class ApiKeyRepo:
         return [self._row_to_dict(r) for r in rows]
 
     def get_stats(self) -> dict:
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute("SELECT COUNT(*) AS c FROM api_keys")
             total = int(cur.fetchone()["c"])
             cur.execute("SELECT COUNT(*) AS c FROM api_keys WHERE enabled = 1")
@@ -276,7 +678,7 @@ class ApiKeyRepo:
         }
 
     def get_by_id(self, key_id: str) -> Optional[dict]:
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute(
                 """
                 SELECT key_id, key_enc, name, created_at_ms, last_used_ms, enabled, total_requests
@@ -295,10 +697,10 @@ class ApiKeyRepo:
             cur.execute(
                 """
                 INSERT INTO api_keys (
-                  key_id, key_enc, name, created_at_ms, enabled, last_used_ms, total_requests
-                ) VALUES (?, ?, ?, ?, 1, NULL, 0)
+                  key_id, key_enc, name, created_at_ms, enabled, last_used_ms, total_requests, key_hash
+                ) VALUES (?, ?, ?, ?, 1, NULL, 0, ?)
                 """,
-                (key_id, key_enc, name, now_ms),
+                (key_id, key_enc, name, now_ms, _key_hash(full_key)),
             )
 
     def update(self, key_id: str, name: str, enabled: bool) -> bool:
@@ -323,8 +725,8 @@ class ApiKeyRepo:
         key_enc = self._encrypt_key(new_full_key)
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute(
-                "UPDATE api_keys SET key_enc = ? WHERE key_id = ?",
-                (key_enc, key_id),
+                "UPDATE api_keys SET key_enc = ?, key_hash = ? WHERE key_id = ?",
+                (key_enc, _key_hash(new_full_key), key_id),
             )
             return cur.rowcount > 0
 
@@ -333,12 +735,25 @@ class ApiKeyRepo:
         now_ms = _now_ms()
 
         with get_db_cursor(self._paths.app_db_path) as cur:
+            # 热路径：key_hash 索引等值命中，一条语句完成校验 + 计数；
+            # 老 SQLite 不支持 RETURNING 时拆成 SELECT + UPDATE（同一事务内）
+            if _RETURNING_SUPPORTED:
+                cur.execute(_VALIDATE_TOUCH_SQL, (now_ms, _key_hash(full_key)))
+                r = cur.fetchone()
+            else:
+                cur.execute(_VALIDATE_SELECT_SQL, (_key_hash(full_key),))
+                r = cur.fetchone()
+                if r:
+                    cur.execute(_VALIDATE_TOUCH_FALLBACK_SQL, (now_ms, r["key_id"]))
+            if r:
+                return {"key_id": r["key_id"], "name": r["name"]}
+
+            # 老库行尚未回填 key_hash：退回遍历解密比较，命中后顺手回填
             cur.execute(
-                "SELECT key_id, key_enc, name FROM api_keys WHERE enabled = 1"
+                "SELECT key_id, key_enc, name FROM api_keys WHERE enabled = 1 AND key_hash IS NULL"
             )
             rows = cur.fetchall()
 
-            # 遍历解密比较
             matched_row = None
             for r in rows:
                 try:
@@ -352,275 +767,227 @@ class ApiKeyRepo:
                 return None
 
             cur.execute(
-                "UPDATE api_keys SET last_used_ms = ?, total_requests = total_requests + 1 WHERE key_id = ?",
-                (now_ms, matched_row["key_id"]),
+                """
+                UPDATE api_keys
+                SET key_hash = ?, last_used_ms = ?, total_requests = total_requests + 1
+                WHERE key_id = ?
+                """,
+                (_key_hash(full_key), now_ms, matched_row["key_id"]),
             )
 
         return {"key_id": matched_row["key_id"], "name": matched_row["name"]}
 
 
 class LogRepo:
-    _last_cleanup_check_date: Optional[str] = None
+    _last_cleanup_check_day: Optional[int] = None
 
-    def __init__(self):
+    def __init__(self, provider_repo: Optional[ProviderRepo] = None):
         self._paths = get_db_paths()
+        # 注入共享的 ProviderRepo，避免每次查询各自新建实例
+        self._provider_repo = provider_repo or _provider_repo()
 
     def _perform_log_cleanup_if_needed(self) -> None:
         """
         Checks if log cleanup is needed and performs it.
-        This is triggered once per day on the first log write.
+        Runs at most once per day, from the batch-writer flush path
+        (not the request path). The DELETE is an index range on the
+        materialized `day` column — no per-row strftime.
         """
-        today = datetime.now().strftime("%Y-%m-%d")
-        if today == LogRepo._last_cleanup_check_date:
+        today = day_number(_now_ms())
+        if today == LogRepo._last_cleanup_check_day:
             return
 
-        LogRepo._last_cleanup_check_date = today
+        LogRepo._last_cleanup_check_day = today
 
         from .config import get_config
         config = get_config()
         log_retention_days = config.log_retention_days
 
+        cutoff = today - log_retention_days + 1
         with get_db_cursor(self._paths.logs_db_path) as cur:
-            # Get all distinct log dates
-            cur.execute(
-                """
-                SELECT DISTINCT strftime('%Y-%m-%d', timestamp_ms / 1000, 'unixepoch', 'localtime') as day
-                FROM request_logs
-                ORDER BY day ASC
-                """
-            )
-            days = [row[0] for row in cur.fetchall()]
-
-            if len(days) >= log_retention_days:
-                # Delete logs from the oldest day
-                oldest_day = days[0]
-                cur.execute(
-                    """
-                    DELETE FROM request_logs
-                    WHERE strftime('%Y-%m-%d', timestamp_ms / 1000, 'unixepoch', 'localtime') = ?
-                    """,
-                    (oldest_day,),
-                )
-                print(f"[LOG-CLEANUP] Deleted logs from {oldest_day} as retention period of {log_retention_days} days was met.")
+            cur.execute("DELETE FROM request_logs WHERE day < ?", (cutoff,))
+            if cur.rowcount > 0:
+                print(f"[LOG-CLEANUP] Deleted {cur.rowcount} request logs older than {log_retention_days} days.")
+                # 分批把清理释放的页还给文件系统（库已启用增量回收）
+                cur.execute("PRAGMA incremental_vacuum(5000)")
+            # 每日一次刷新规划器统计，让持续追加的日志表保持走对索引
+            cur.execute("PRAGMA optimize")
 
     def insert(self, entry: dict[str, Any]) -> None:
-        self._perform_log_cleanup_if_needed()
-        with get_db_cursor(self._paths.logs_db_path) as cur:
-            cur.execute(
-                """
-                INSERT OR REPLACE INTO request_logs (
-                  id, timestamp_ms, level, type, method, path, protocol,
-                  status_code, duration_ms, message, error, client_ip,
-                  api_key_id, provider_id, unified_model, actual_model,
-                  prompt_tokens, completion_tokens, total_tokens
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    entry["id"],
-                    entry["timestamp_ms"],
-                    entry["level"],
-                    entry["type"],
-                    entry["method"],
-                    entry["path"],
-                    entry.get("protocol"),
-                    entry.get("status_code"),
-                    entry.get("duration_ms"),
-                    entry.get("message"),
-                    entry.get("error"),
-                    entry.get("client_ip"),
-                    entry.get("api_key_id"),
-                    entry.get("provider_id"),
-                    entry.get("unified_model"),
-                    entry.get("actual_model"),
-                    entry.get("prompt_tokens"),
-                    entry.get("completion_tokens"),
-                    entry.get("total_tokens"),
-                ),
+        """入队即返回；实际写入由后台批量写入器完成。"""
+        _request_log_writer.append(
+            (
+                entry["id"],
+                entry["timestamp_ms"],
+                entry["level"],
+                entry["type"],
+                entry["method"],
+                entry["path"],
+                entry.get("protocol"),
+                entry.get("status_code"),
+                entry.get("duration_ms"),
+                entry.get("message"),
+                entry.get("error"),
+                entry.get("client_ip"),
+                entry.get("api_key_id"),
+                entry.get("provider_id"),
+                entry.get("unified_model"),
+                entry.get("actual_model"),
+                entry.get("prompt_tokens"),
+                entry.get("completion_tokens"),
+                entry.get("total_tokens"),
+                day_number(entry["timestamp_ms"]),
             )
+        )
 
-    def get_recent(
+    def flush(self) -> None:
+        """同步落盘积压的日志（读取前 / 关闭前调用）。"""
+        _request_log_writer.flush()
+
+    def iter_recent(
         self,
         limit: int,
         level: Optional[str] = None,
         log_type: Optional[str] = None,  # 保留参数兼容性，但不再使用
         keyword: Optional[str] = None,
         provider: Optional[str] = None,
-    ) -> list[dict]:
-        with get_db_cursor(self._paths.logs_db_path) as cur:
-            query = "SELECT * FROM request_logs WHERE 1=1"
-            params = []
-
-            if level:
-                query += " AND level = ?"
-                params.append(level)
+    ) -> Generator[dict, None, None]:
+        """流式版 get_recent：逐行产出 dict，峰值内存不随 limit 增长。"""
+        self.flush()
+        # 本方法要用两次 id→name 映射（关键字匹配 + 结果补全），取一次复用
+        id_name_map = self._provider_repo.get_id_name_map()
+        with get_read_cursor(self._paths.logs_db_path) as cur:
+            # 位置取值：sqlite3.Row 的按名取列是对列描述的线性扫描，
+            # limit=1000 时约 2 万次查找；改用元组 + 一次性解包
+            cur.row_factory = None
+            cur.arraysize = 1000
             # log_type 参数不再需要，request_logs 表只存 proxy 日志
-            if provider:
-                query += " AND provider_id = ?"
-                params.append(provider)
-
+            keyword_mode = ""
+            matched_provider_ids: list[str] = []
             if keyword:
-                kw = f"%{keyword}%"
                 # 搜索 Provider 名称 -> provider_id
-                provider_repo = ProviderRepo()
-                matched_provider_ids = []
-                for pid, pname in provider_repo.get_id_name_map().items():
+                for pid, pname in id_name_map.items():
                     if keyword.lower() in pname.lower():
                         matched_provider_ids.append(pid)
+                # 文本搜索优先走 FTS5 索引（token 前缀匹配），
+                # FTS 不可用时退回逐行 LIKE 扫描
+                keyword_mode = "fts" if fts5_available() else "like"
 
-                # 构建搜索条件：文本字段 OR provider_id 匹配
-                conditions = ["message LIKE ?", "unified_model LIKE ?", "actual_model LIKE ?", "error LIKE ?"]
+            query = _recent_logs_query(
+                bool(level), bool(provider), keyword_mode, len(matched_provider_ids)
+            )
+            params: list = []
+            if level:
+                params.append(level)
+            if provider:
+                params.append(provider)
+            if keyword_mode == "fts":
+                params.append(_fts_match_query(keyword))
+            elif keyword_mode == "like":
+                kw = f"%{keyword}%"
                 params.extend([kw, kw, kw, kw])
-
-                if matched_provider_ids:
-                    placeholders = ",".join("?" for _ in matched_provider_ids)
-                    conditions.append(f"provider_id IN ({placeholders})")
-                    params.extend(matched_provider_ids)
-
-                query += f" AND ({' OR '.join(conditions)})"
-            
-            query += " ORDER BY timestamp_ms DESC LIMIT ?"
+            params.extend(matched_provider_ids)
             params.append(limit)
-            
+
             cur.execute(query, params)
-            rows = cur.fetchall()
-            
-            # Convert to dicts matching RequestLog structure
-            provider_repo = ProviderRepo()
-            id_name_map = provider_repo.get_id_name_map()
-            
-            logs = []
-            for r in rows:
-                pid = r["provider_id"]
-                logs.append({
-                    "id": r["id"],
-                    "timestamp": r["timestamp_ms"] / 1000.0,
-                    "level": r["level"],
-                    "type": r["type"],
-                    "method": r["method"],
-                    "path": r["path"],
-                    "protocol": r["protocol"],
-                    "status_code": r["status_code"],
-                    "duration_ms": r["duration_ms"],
-                    "message": r["message"],
-                    "error": r["error"],
-                    "client_ip": r["client_ip"],
-                    "api_key_id": r["api_key_id"],
+
+            # 直接迭代游标：sqlite 按 arraysize 分块取行，
+            # 不把整个结果集和 dict 副本同时压进内存
+            for (
+                id_, timestamp_ms, level_, type_, method, path, protocol,
+                status_code, duration_ms, message, error, client_ip,
+                api_key_id, pid, unified_model, actual_model,
+                prompt_tokens, completion_tokens, total_tokens,
+            ) in cur:
+                yield {
+                    "id": id_,
+                    "timestamp": timestamp_ms / 1000.0,
+                    "level": level_,
+                    "type": type_,
+                    "method": method,
+                    "path": path,
+                    "protocol": protocol,
+                    "status_code": status_code,
+                    "duration_ms": duration_ms,
+                    "message": message,
+                    "error": error,
+                    "client_ip": client_ip,
+                    "api_key_id": api_key_id,
                     "provider_id": pid,
-                    "model": r["unified_model"],
-                    "actual_model": r["actual_model"],
-                    "request_tokens": r["prompt_tokens"],
-                    "response_tokens": r["completion_tokens"],
-                    "total_tokens": r["total_tokens"],
-                    "provider": id_name_map.get(pid, pid) if pid else None
-                })
-            return logs
+                    "model": unified_model,
+                    "actual_model": actual_model,
+                    "request_tokens": prompt_tokens,
+                    "response_tokens": completion_tokens,
+                    "total_tokens": total_tokens,
+                    "provider": id_name_map.get(pid, pid) if pid else None,
+                }
+
+    def get_recent(
+        self,
+        limit: int,
+        level: Optional[str] = None,
+        log_type: Optional[str] = None,  # 保留参数兼容性，但不再使用
+        keyword: Optional[str] = None,
+        provider: Optional[str] = None,
+    ) -> list[dict]:
+        return list(self.iter_recent(limit, level=level, log_type=log_type, keyword=keyword, provider=provider))
 
     def get_stats(self, date_str: Optional[str] = None, tag: Optional[str] = None) -> dict:
         """
         Get aggregated stats from logs.db
         Refactored to use efficient aggregation (similar to get_daily_stats)
         """
-        # 1. Build Filter Conditions
-        where_clauses = ["1=1"]
+        self.flush()
+        # 1. Build Filter Params（SQL 模板按过滤形状缓存，见 _stats_queries）
+        has_date = False
         params = []
-        
+
         if date_str:
             try:
                 dt = datetime.strptime(date_str, "%Y-%m-%d")
                 start_ms = int(dt.timestamp() * 1000)
                 end_ms = int((dt + timedelta(days=1)).timestamp() * 1000)
-                where_clauses.append("timestamp_ms >= ? AND timestamp_ms < ?")
                 params.extend([start_ms, end_ms])
+                has_date = True
             except ValueError:
                 pass
-        
+
         if tag:
-            key_id = None
-            with get_db_cursor(self._paths.app_db_path) as app_cur:
-                app_cur.execute("SELECT key_id FROM api_keys WHERE name = ?", (tag,))
-                row = app_cur.fetchone()
-                if row:
-                    key_id = row["key_id"]
-            
-            if key_id:
-                where_clauses.append("api_key_id = ?")
-                params.append(key_id)
-            else:
-                where_clauses.append("1=0")
-        
-        where_sql = " AND ".join(where_clauses)
-        
-        with get_db_cursor(self._paths.logs_db_path) as cur:
-            # 2. Main Aggregation Query (Provider & Model stats)
-            # This single query replaces 5 separate queries (Total, Tokens, Success, Provider Usage, Model Usage, Provider-Model Stats)
-            cur.execute(
-                f"""
-                SELECT provider_id, unified_model,
-                       COUNT(*) as total,
-                       SUM(CASE WHEN status_code = 200 THEN 1 ELSE 0 END) as success,
-                       SUM(total_tokens) as tokens
-                FROM request_logs
-                WHERE {where_sql}
-                GROUP BY provider_id, unified_model
-                """,
-                params
-            )
-            rows = cur.fetchall()
+            params.append(tag)
+
+        totals_sql, grouped_sql, hourly_sql = _stats_queries(has_date, bool(tag))
+
+        with get_read_cursor(self._paths.logs_db_path) as cur:
+            # 2. Global totals in one scan (includes rows with NULL provider/model)
+            cur.execute(totals_sql, params)
+            total_requests, successful_requests, total_tokens = cur.fetchone()
+            successful_requests = successful_requests or 0
+
+            # 3. Per-provider nested stats assembled server-side：
+            #    内层聚合后用 json_group_object 直接拼出 {model: stats} 结构，
+            #    跨 C↔Python 边界的行数从 providers×models 降为 providers
+            cur.execute(grouped_sql, params)
+            provider_rows = cur.fetchall()
 
-            # 3. Process Main Aggregation Results
-            total_requests = 0
-            total_tokens = 0
-            successful_requests = 0
             provider_usage = {}
             model_usage = {}
             provider_model_stats = {}
             model_provider_stats = {}
 
-            for r in rows:
-                pid = r["provider_id"]
-                model = r["unified_model"]
-                total = r["total"]
-                success = r["success"]
-                tokens = r["tokens"] or 0
-
-                # Global Aggregation
-                total_requests += total
-                successful_requests += success
-                total_tokens += tokens
-
-                # Skip invalid rows for detailed stats
-                if not pid or not model:
-                    continue
-
-                # Provider Usage
-                provider_usage[pid] = provider_usage.get(pid, 0) + total
-                
-                # Model Usage
-                model_usage[model] = model_usage.get(model, 0) + total
-
-                # Detailed Stats Construction
-                if pid not in provider_model_stats:
-                    provider_model_stats[pid] = {}
-                if model not in model_provider_stats:
-                    model_provider_stats[model] = {}
-
-                stats_obj = {
-                    "total": total,
-                    "successful": success,
-                    "failed": total - success,
-                    "tokens": tokens
-                }
-                
-                provider_model_stats[pid][model] = stats_obj
-                model_provider_stats[model][pid] = stats_obj
+            for pid, models_json in provider_rows:
+                models = _json_loads(models_json)
+                provider_model_stats[pid] = models
+                provider_total = 0
+                for model, stats_obj in models.items():
+                    model_provider_stats.setdefault(model, {})[pid] = stats_obj
+                    model_usage[model] = model_usage.get(model, 0) + stats_obj["total"]
+                    provider_total += stats_obj["total"]
+                provider_usage[pid] = provider_total
 
             # 4. Hourly Trends Query (Only if date filter is active)
             hourly_requests = {}
-            if date_str:
-                cur.execute(
-                    f"SELECT strftime('%H', timestamp_ms / 1000, 'unixepoch', 'localtime') as hour, COUNT(*) FROM request_logs WHERE {where_sql} GROUP BY hour",
-                    params
-                )
+            if has_date:
+                cur.execute(hourly_sql, params)
                 for r in cur.fetchall():
                     hourly_requests[r[0]] = r[1]
 
@@ -637,6 +1004,7 @@ class LogRepo:
             }
 
     def get_daily_stats(self, days: int = 7, tag: Optional[str] = None) -> list[dict]:
+        self.flush()
         # 1. Determine date range
         from .config import get_config
         config = get_config()
@@ -654,25 +1022,17 @@ class LogRepo:
         where_sql = "timestamp_ms >= ?"
 
         if tag:
-            key_id = None
-            with get_db_cursor(self._paths.app_db_path) as app_cur:
-                app_cur.execute("SELECT key_id FROM api_keys WHERE name = ?", (tag,))
-                row = app_cur.fetchone()
-                if row:
-                    key_id = row["key_id"]
-            
-            if key_id:
-                where_sql += " AND api_key_id = ?"
-                params.append(key_id)
-            else:
-                # If tag is specified but not found, return no results
-                where_sql += " AND 1=0"
+            # tag 不存在时子查询返回 NULL → 不匹配任何行
+            where_sql += " AND api_key_id = (SELECT key_id FROM app.api_keys WHERE name = ?)"
+            params.append(tag)
 
         # 3. Comprehensive SQL query
-        with get_db_cursor(self._paths.logs_db_path) as cur:
+        with get_read_cursor(self._paths.logs_db_path) as cur:
+            # 按写入时物化的整数 day 列分组，避免对每行扫描执行 strftime；
+            # day 列已折算配置时区（与本函数的 _TZ 口径一致）
             sql = f"""
                 SELECT
-                    strftime('%Y-%m-%d', timestamp_ms / 1000, 'unixepoch', 'localtime') as day,
+                    day,
                     provider_id,
                     unified_model,
                     COUNT(*) as total,
@@ -687,29 +1047,39 @@ class LogRepo:
             rows = cur.fetchall()
 
         # 4. Process results in Python
-        provider_repo = ProviderRepo()
-        provider_map = provider_repo.get_id_name_map()
-        daily_aggregated_data = {}
+        provider_map = self._provider_repo.get_id_name_map()
+
+        def _empty_day(date_str: str) -> dict:
+            return {
+                "date": date_str,
+                "total_requests": 0,
+                "successful_requests": 0,
+                "total_tokens": 0,
+                "model_usage": {},
+                # defaultdict 省去内层的成员判断；对 JSON 序列化透明
+                "provider_model_stats": defaultdict(dict),
+                "model_provider_stats": defaultdict(dict),
+            }
+
+        daily_aggregated_data: dict[str, dict] = {}
+        day_names: dict[int, str] = {}
 
         for r in rows:
-            day_str = r["day"]
+            day_num = r["day"]
+            # 日序号 → 日期字符串，每个不同的天只转换一次
+            day_str = day_names.get(day_num)
+            if day_str is None:
+                day_str = day_names[day_num] = datetime.fromtimestamp(
+                    day_num * 86400, timezone.utc
+                ).strftime("%Y-%m-%d")
             provider_id = r["provider_id"]
             model = r["unified_model"]
             provider_name = provider_map.get(provider_id, provider_id)
 
-            if day_str not in daily_aggregated_data:
-                daily_aggregated_data[day_str] = {
-                    "date": day_str,
-                    "total_requests": 0,
-                    "successful_requests": 0,
-                    "total_tokens": 0,
-                    "model_usage": {},
-                    "provider_model_stats": {},
-                    "model_provider_stats": {},
-                }
+            day_data = daily_aggregated_data.get(day_str)
+            if day_data is None:
+                day_data = daily_aggregated_data[day_str] = _empty_day(day_str)
 
-            day_data = daily_aggregated_data[day_str]
-            
             total = r["total"]
             successful = r["successful"]
             tokens = r["tokens"] or 0
@@ -719,94 +1089,83 @@ class LogRepo:
             day_data["total_tokens"] += tokens
             day_data["model_usage"][model] = day_data["model_usage"].get(model, 0) + total
 
-            if provider_name not in day_data["provider_model_stats"]:
-                day_data["provider_model_stats"][provider_name] = {}
-            if model not in day_data["model_provider_stats"]:
-                day_data["model_provider_stats"][model] = {}
-
             stats_obj = {"total": total, "successful": successful, "failed": total - successful, "tokens": tokens}
             day_data["provider_model_stats"][provider_name][model] = stats_obj
             day_data["model_provider_stats"][model][provider_name] = stats_obj
 
-        # 5. Generate final list, filling in missing days
-        result = []
-        for i in range(days):
-            current_dt = end_dt - timedelta(days=i)
-            date_str = current_dt.strftime("%Y-%m-%d")
-            
-            if date_str in daily_aggregated_data:
-                result.append(daily_aggregated_data[date_str])
-            else:
-                result.append({
-                    "date": date_str,
-                    "total_requests": 0,
-                    "successful_requests": 0,
-                    "total_tokens": 0,
-                    "model_usage": {},
-                    "provider_model_stats": {},
-                    "model_provider_stats": {},
-                })
-                
-        return result[::-1]
+        # 5. Generate final list (oldest first), filling in missing days
+        expected_days = [(end_dt - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+        return [
+            daily_aggregated_data.get(date_str) or _empty_day(date_str)
+            for date_str in reversed(expected_days)
+        ]
+
+
+# 请求日志批量写入器：清理检查跟随批量落盘（写入线程），不再挂在请求路径上
+_request_log_writer = _BatchLogWriter(
+    get_db_paths().logs_db_path,
+    _INSERT_REQUEST_LOG_SQL,
+    on_flush=lambda: LogRepo()._perform_log_cleanup_if_needed(),
+)
+
+
+_INSERT_EVENT_LOG_SQL = """
+    INSERT OR REPLACE INTO event_logs (
+      id, timestamp_ms, level, type, message, error,
+      provider_id, provider_name, model, actual_model, client_ip, status_code, duration_ms, day
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
 
 class EventLogRepo:
     """Repository for event logs (non-proxy logs: sync, breaker, auth, admin, system)"""
-    _last_cleanup_check_date: Optional[str] = None
+    _last_cleanup_check_day: Optional[int] = None
 
     def __init__(self):
         self._paths = get_db_paths()
 
     def _perform_cleanup_if_needed(self) -> None:
-        today = datetime.now().strftime("%Y-%m-%d")
-        if today == EventLogRepo._last_cleanup_check_date:
+        today = day_number(_now_ms())
+        if today == EventLogRepo._last_cleanup_check_day:
             return
-        EventLogRepo._last_cleanup_check_date = today
+        EventLogRepo._last_cleanup_check_day = today
 
         from .config import get_config
         config = get_config()
         log_retention_days = config.log_retention_days
 
+        # 与 request_logs 相同：按物化的整数 day 列做范围删除，
+        # 不再全表扫描 strftime 找最老的一天
+        cutoff = today - log_retention_days + 1
         with get_db_cursor(self._paths.logs_db_path) as cur:
-            cur.execute(
-                """
-                SELECT DISTINCT strftime('%Y-%m-%d', timestamp_ms / 1000, 'unixepoch', 'localtime') as day
-                FROM event_logs ORDER BY day ASC
-                """
-            )
-            days = [row[0] for row in cur.fetchall()]
-            if len(days) >= log_retention_days:
-                oldest_day = days[0]
-                cur.execute(
-                    "DELETE FROM event_logs WHERE strftime('%Y-%m-%d', timestamp_ms / 1000, 'unixepoch', 'localtime') = ?",
-                    (oldest_day,),
-                )
+            cur.execute("DELETE FROM event_logs WHERE day < ?", (cutoff,))
+            if cur.rowcount > 0:
+                cur.execute("PRAGMA incremental_vacuum(5000)")
 
     def insert(self, entry: dict[str, Any]) -> None:
-        self._perform_cleanup_if_needed()
-        with get_db_cursor(self._paths.logs_db_path) as cur:
-            cur.execute(
-                """
-                INSERT INTO event_logs (
-                  id, timestamp_ms, level, type, message, error,
-                  provider_id, model, actual_model, client_ip, status_code, duration_ms
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    entry["id"],
-                    entry["timestamp_ms"],
-                    entry["level"],
-                    entry["type"],
-                    entry.get("message"),
-                    entry.get("error"),
-                    entry.get("provider_id"),
-                    entry.get("model"),
-                    entry.get("actual_model"),
-                    entry.get("client_ip"),
-                    entry.get("status_code"),
-                    entry.get("duration_ms"),
-                ),
+        """入队即返回；实际写入由后台批量写入器完成。"""
+        _event_log_writer.append(
+            (
+                entry["id"],
+                entry["timestamp_ms"],
+                entry["level"],
+                entry["type"],
+                entry.get("message"),
+                entry.get("error"),
+                entry.get("provider_id"),
+                entry.get("provider_name"),
+                entry.get("model"),
+                entry.get("actual_model"),
+                entry.get("client_ip"),
+                entry.get("status_code"),
+                entry.get("duration_ms"),
+                day_number(entry["timestamp_ms"]),
             )
+        )
+
+    def flush(self) -> None:
+        """同步落盘积压的事件日志（读取前 / 关闭前调用）。"""
+        _event_log_writer.flush()
 
     def get_recent(
         self,
@@ -815,44 +1174,50 @@ class EventLogRepo:
         log_type: Optional[str] = None,
         keyword: Optional[str] = None,
     ) -> list[dict]:
-        with get_db_cursor(self._paths.logs_db_path) as cur:
-            query = "SELECT * FROM event_logs WHERE 1=1"
+        self.flush()
+        with get_read_cursor(self._paths.logs_db_path) as cur:
+            # provider 名称优先读写入时冗余的 provider_name 列；
+            # 老行（列为 NULL）回退到 ATTACH 的应用库 join 解析
+            query = (
+                "SELECT e.*, COALESCE(e.provider_name, p.name) AS provider_display"
+                " FROM event_logs e"
+                " LEFT JOIN app.providers p ON p.provider_id = e.provider_id"
+                " WHERE 1=1"
+            )
             params = []
 
             if level:
-                query += " AND level = ?"
+                query += " AND e.level = ?"
                 params.append(level)
             if log_type:
-                query += " AND type = ?"
+                query += " AND e.type = ?"
                 params.append(log_type)
             if keyword:
-                kw = f"%{keyword}%"
-                # 搜索 Provider 名称 -> provider_id
-                provider_repo = ProviderRepo()
-                matched_provider_ids = []
-                for pid, pname in provider_repo.get_id_name_map().items():
-                    if keyword.lower() in pname.lower():
-                        matched_provider_ids.append(pid)
-
-                conditions = ["message LIKE ?", "model LIKE ?", "actual_model LIKE ?", "error LIKE ?"]
-                params.extend([kw, kw, kw, kw])
-
-                if matched_provider_ids:
-                    placeholders = ",".join("?" for _ in matched_provider_ids)
-                    conditions.append(f"provider_id IN ({placeholders})")
-                    params.extend(matched_provider_ids)
+                # 文本搜索优先走 FTS5 索引（token 前缀匹配），
+                # FTS 不可用时退回逐行 LIKE 扫描
+                if fts5_available():
+                    conditions = [
+                        "e.rowid IN (SELECT rowid FROM event_logs_fts WHERE event_logs_fts MATCH ?)"
+                    ]
+                    params.append(_fts_match_query(keyword))
+                else:
+                    kw = f"%{keyword}%"
+                    conditions = ["e.message LIKE ?", "e.model LIKE ?", "e.actual_model LIKE ?", "e.error LIKE ?"]
+                    params.extend([kw, kw, kw, kw])
+                # Provider 名称匹配直接落在解析出的显示名上
+                conditions.append(
+                    "LOWER(COALESCE(e.provider_name, p.name)) LIKE '%' || LOWER(?) || '%'"
+                )
+                params.append(keyword)
 
                 query += f" AND ({' OR '.join(conditions)})"
 
-            query += " ORDER BY timestamp_ms DESC LIMIT ?"
+            query += " ORDER BY e.timestamp_ms DESC LIMIT ?"
             params.append(limit)
 
             cur.execute(query, params)
             rows = cur.fetchall()
 
-            provider_repo = ProviderRepo()
-            id_name_map = provider_repo.get_id_name_map()
-
             logs = []
             for r in rows:
                 pid = r["provider_id"]
@@ -869,11 +1234,45 @@ class EventLogRepo:
                     "client_ip": r["client_ip"],
                     "status_code": r["status_code"],
                     "duration_ms": r["duration_ms"],
-                    "provider": id_name_map.get(pid, pid) if pid else None,
+                    "provider": (r["provider_display"] or pid) if pid else None,
                 })
             return logs
 
 
+# 事件日志批量写入器：与请求日志共用 _BatchLogWriter，清理同样跟随落盘
+_event_log_writer = _BatchLogWriter(
+    get_db_paths().logs_db_path,
+    _INSERT_EVENT_LOG_SQL,
+    on_flush=lambda: EventLogRepo()._perform_cleanup_if_needed(),
+)
+
+
+# 热路径 SQL 常量：同一字符串对象反复传入，保证命中连接的
+# prepared-statement 缓存（拼接/内联字符串每次都是新的 prepare）
+_UPSERT_PROVIDER_MODEL_SQL = """
+    INSERT INTO provider_models (
+      provider_id, model_id, owned_by, supported_endpoint_types_json,
+      created_at_ms, last_activity_ms, last_activity_type
+    ) VALUES (?, ?, ?, ?, ?, NULL, NULL)
+    ON CONFLICT(provider_id, model_id) DO UPDATE SET
+      owned_by=excluded.owned_by,
+      supported_endpoint_types_json=excluded.supported_endpoint_types_json
+"""
+
+_UPDATE_ACTIVITY_SQL = """
+    UPDATE provider_models
+    SET last_activity_ms = ?, last_activity_type = ?
+    WHERE provider_id = ? AND model_id = ?
+"""
+
+
+def _parse_types(v: Optional[str]) -> list:
+    """解码 supported_endpoint_types_json，空值/空数组直接短路不走解析器"""
+    if not v or v == "[]":
+        return []
+    return _json_loads(v)
+
+
 class ProviderModelsRepo:
     def __init__(self):
         self._paths = get_db_paths()
@@ -882,11 +1281,14 @@ class ProviderModelsRepo:
         """
         Returns {model_id: {owned_by, supported_endpoint_types, ...}}
         """
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
+            # 列名在 SQL 里直接别名成输出键，Python 侧 dict(row) 一把构建，
+            # 只需补一次 JSON 反序列化，免去逐键取值/重命名
             cur.execute(
                 """
                 SELECT model_id, owned_by, supported_endpoint_types_json,
-                       created_at_ms, last_activity_ms, last_activity_type
+                       created_at_ms AS created_at, last_activity_ms AS last_activity,
+                       last_activity_type
                 FROM provider_models
                 WHERE provider_id = ?
                 ORDER BY model_id
@@ -897,45 +1299,34 @@ class ProviderModelsRepo:
 
         result = {}
         for r in rows:
-            result[r["model_id"]] = {
-                "model_id": r["model_id"],
-                "owned_by": r["owned_by"],
-                "supported_endpoint_types": json.loads(r["supported_endpoint_types_json"] or "[]"),
-                "created_at": r["created_at_ms"],
-                "last_activity": r["last_activity_ms"],
-                "last_activity_type": r["last_activity_type"],
-            }
+            d = dict(r)
+            d["supported_endpoint_types"] = _parse_types(d.pop("supported_endpoint_types_json"))
+            result[d["model_id"]] = d
         return result
 
     def get_all_provider_models(self) -> dict[str, dict[str, dict]]:
         """
         Returns {provider_id: {model_id: {...}}}
         """
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute(
                 """
                 SELECT provider_id, model_id, owned_by, supported_endpoint_types_json,
-                       created_at_ms, last_activity_ms, last_activity_type
+                       created_at_ms AS created_at, last_activity_ms AS last_activity,
+                       last_activity_type
                 FROM provider_models
                 ORDER BY provider_id, model_id
                 """
             )
             rows = cur.fetchall()
 
-        result = {}
+        result: dict[str, dict[str, dict]] = defaultdict(dict)
         for r in rows:
-            pid = r["provider_id"]
-            if pid not in result:
-                result[pid] = {}
-            result[pid][r["model_id"]] = {
-                "model_id": r["model_id"],
-                "owned_by": r["owned_by"],
-                "supported_endpoint_types": json.loads(r["supported_endpoint_types_json"] or "[]"),
-                "created_at": r["created_at_ms"],
-                "last_activity": r["last_activity_ms"],
-                "last_activity_type": r["last_activity_type"],
-            }
-        return result
+            d = dict(r)
+            pid = d.pop("provider_id")
+            d["supported_endpoint_types"] = _parse_types(d.pop("supported_endpoint_types_json"))
+            result[pid][d["model_id"]] = d
+        return dict(result)
 
     def upsert_models(self, provider_id: str, models: list[dict]) -> None:
         """
@@ -943,28 +1334,24 @@ class ProviderModelsRepo:
           model_id, owned_by, supported_endpoint_types (list)
           created_at (optional int ms)
         """
+        if not models:
+            return
+        now_ms = _now_ms()
+        # Metadata (owned_by, supported_types) is updated on conflict,
+        # activity columns are kept as-is.
+        rows = [
+            (
+                provider_id,
+                m["model_id"],
+                m.get("owned_by", ""),
+                _json_dumps(m.get("supported_endpoint_types", [])),
+                m.get("created_at") or now_ms,
+            )
+            for m in models
+        ]
         with get_db_cursor(self._paths.app_db_path) as cur:
-            now_ms = _now_ms()
-            
-            for m in models:
-                supported_json = json.dumps(m.get("supported_endpoint_types", []), ensure_ascii=False)
-                created_at = m.get("created_at") or now_ms
-                
-                # Using INSERT OR IGNORE to keep existing data (like last_activity) safe?
-                # Or UPSERT to update metadata? 
-                # We should update metadata (owned_by, supported_types) but keep activity if exists.
-                cur.execute(
-                    """
-                    INSERT INTO provider_models (
-                      provider_id, model_id, owned_by, supported_endpoint_types_json,
-                      created_at_ms, last_activity_ms, last_activity_type
-                    ) VALUES (?, ?, ?, ?, ?, NULL, NULL)
-                    ON CONFLICT(provider_id, model_id) DO UPDATE SET
-                      owned_by=excluded.owned_by,
-                      supported_endpoint_types_json=excluded.supported_endpoint_types_json
-                    """,
-                    (provider_id, m["model_id"], m.get("owned_by", ""), supported_json, created_at),
-                )
+            # 单事务 + executemany：整批只走一次 prepare/一次 fsync
+            cur.executemany(_UPSERT_PROVIDER_MODEL_SQL, rows)
 
     def delete_models(self, provider_id: str, model_ids: list[str]) -> None:
         if not model_ids:
@@ -984,39 +1371,81 @@ class ProviderModelsRepo:
 
     def update_activity(self, provider_id: str, model_id: str, activity_type: str) -> None:
         with get_db_cursor(self._paths.app_db_path) as cur:
-            cur.execute(
-                """
-                UPDATE provider_models
-                SET last_activity_ms = ?, last_activity_type = ?
-                WHERE provider_id = ? AND model_id = ?
-                """,
-                (_now_ms(), activity_type, provider_id, model_id),
-            )
+            cur.execute(_UPDATE_ACTIVITY_SQL, (_now_ms(), activity_type, provider_id, model_id))
 
     def batch_update_activity(self, updates: list[tuple[str, str, str]]) -> int:
         # updates: [(provider_id, model_id, activity_type), ...]
+        if not updates:
+            return 0
+        now = _now_ms()
+        rows = [(now, atype, pid, mid) for pid, mid, atype in updates]
         with get_db_cursor(self._paths.app_db_path) as cur:
-            now = _now_ms()
-            count = 0
-            for pid, mid, atype in updates:
-                cur.execute(
-                    """
-                    UPDATE provider_models
-                    SET last_activity_ms = ?, last_activity_type = ?
-                    WHERE provider_id = ? AND model_id = ?
-                    """,
-                    (now, atype, pid, mid),
-                )
-                count += cur.rowcount
-            return count
+            # executemany 的 rowcount 即整批实际命中的行数
+            cur.executemany(_UPDATE_ACTIVITY_SQL, rows)
+            return cur.rowcount
+
+
+def _mappings_union_sql(filtered: bool) -> str:
+    """主表 + 5 张子表的 UNION ALL 查询；filtered 时每个分支按名过滤。"""
+    w = " WHERE unified_name = ?" if filtered else ""
+    return f"""
+        SELECT 0 AS sect, unified_name, description, last_sync_ms, order_index, enabled, NULL, order_index AS ord
+        FROM model_mappings{w}
+        UNION ALL
+        SELECT 1, unified_name, type, pattern, case_sensitive, NULL, NULL, order_index
+        FROM model_mapping_rules{w}
+        UNION ALL
+        SELECT 2, unified_name, provider_id, model_id, NULL, NULL, NULL, order_index
+        FROM model_mapping_manual_includes{w}
+        UNION ALL
+        SELECT 3, unified_name, provider_id, NULL, NULL, NULL, NULL, 0
+        FROM model_mapping_excluded_providers{w}
+        UNION ALL
+        SELECT 4, unified_name, provider_id, model_id, NULL, NULL, NULL, 0
+        FROM model_mapping_resolved_models{w}
+        UNION ALL
+        SELECT 5, unified_name, provider_id, model_id, protocol, settings_json, NULL, 0
+        FROM model_mapping_model_settings{w}
+        ORDER BY sect, ord, unified_name
+    """
+
+
+_LIST_MAPPINGS_SQL = _mappings_union_sql(False)
+_GET_MAPPING_SQL = _mappings_union_sql(True)
+
+# 写路径高频语句提成常量：同一字符串对象反复传入，
+# 命中连接的 prepared-statement 缓存（与 provider_models 的做法一致）
+_SQL_UPDATE_ORDER = "UPDATE model_mappings SET order_index = ? WHERE unified_name = ?"
+_SQL_INSERT_RULE = "INSERT INTO model_mapping_rules (unified_name, type, pattern, case_sensitive, order_index) VALUES (?, ?, ?, ?, ?)"
+_SQL_INSERT_INCLUDE = "INSERT INTO model_mapping_manual_includes (unified_name, provider_id, model_id, order_index) VALUES (?, ?, ?, ?)"
+_SQL_INSERT_EXCLUDED = "INSERT INTO model_mapping_excluded_providers (unified_name, provider_id) VALUES (?, ?)"
+_SQL_INSERT_RESOLVED = "INSERT INTO model_mapping_resolved_models (unified_name, provider_id, model_id) VALUES (?, ?, ?)"
+_SQL_UPSERT_SETTING = (
+    "INSERT INTO model_mapping_model_settings (unified_name, provider_id, model_id, protocol, settings_json)"
+    " VALUES (?, ?, ?, ?, ?)"
+    " ON CONFLICT(unified_name, provider_id, model_id) DO UPDATE SET"
+    "   protocol = excluded.protocol,"
+    "   settings_json = excluded.settings_json"
+)
 
 
 class ModelMappingRepo:
+    # list_mappings 的进程级快照缓存：(构建时的版本号, 原始结构)。
+    # 所有写方法递增版本号，读路径版本不符才重建（与 provider 名称映射同款）
+    _mappings_version: int = 0
+    _mappings_cache: Optional[tuple[int, dict]] = None
+    # 重建单飞锁：缓存失效时并发调用只有一个线程跑查询，其余等锁后命中快照
+    _mappings_build_lock = threading.Lock()
+
     def __init__(self):
         self._paths = get_db_paths()
 
+    @staticmethod
+    def _invalidate_mappings_cache() -> None:
+        ModelMappingRepo._mappings_version += 1
+
     def get_sync_config(self) -> dict:
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute("SELECT * FROM model_mapping_sync_config WHERE id = 1")
             row = cur.fetchone()
         if not row:
@@ -1049,81 +1478,94 @@ class ModelMappingRepo:
         """
         Returns full mapping dict structure ordered by order_index.
         """
-        with get_db_cursor(self._paths.app_db_path) as cur:
-            # 1. Base mappings (ordered by order_index)
-            cur.execute("SELECT unified_name, description, last_sync_ms, order_index, enabled FROM model_mappings ORDER BY order_index ASC, unified_name ASC")
-            mappings = {}
-            for r in cur.fetchall():
-                mappings[r["unified_name"]] = {
-                    "unified_name": r["unified_name"],
-                    "description": r["description"],
-                    "last_sync": r["last_sync_ms"],
-                    "order_index": r["order_index"],
-                    "enabled": bool(r["enabled"]),
+        cached = ModelMappingRepo._mappings_cache
+        version = ModelMappingRepo._mappings_version
+        if cached is not None and cached[0] == version:
+            # 深拷贝返回，调用方可随意改动而不污染缓存
+            return copy.deepcopy(cached[1])
+
+        with ModelMappingRepo._mappings_build_lock:
+            # 双检：等锁期间可能已有别的线程重建好快照
+            cached = ModelMappingRepo._mappings_cache
+            version = ModelMappingRepo._mappings_version
+            if cached is not None and cached[0] == version:
+                return copy.deepcopy(cached[1])
+
+            # 主表 + 5 张子表合并为一条 UNION ALL 查询：一次 prepare、
+            # 一次结果集传输，Python 侧按 sect 判别列分发。
+            # sect 0 的行排在最前（按 order_index），保证 dict 插入顺序
+            # 与原来主表查询的排序一致；rules/includes 的相对顺序由 ord 保证。
+            with get_read_cursor(self._paths.app_db_path) as cur:
+                cur.row_factory = None
+                cur.execute(_LIST_MAPPINGS_SQL)
+                mappings = self._collect_mappings(cur)
+
+            ModelMappingRepo._mappings_cache = (version, mappings)
+        return copy.deepcopy(mappings)
+
+    def get_mapping(self, unified_name: str) -> Optional[dict]:
+        """单个映射的按名查询：快照新鲜时直接取，否则只读该映射的行。"""
+        cached = ModelMappingRepo._mappings_cache
+        if cached is not None and cached[0] == ModelMappingRepo._mappings_version:
+            m = cached[1].get(unified_name)
+            return copy.deepcopy(m) if m is not None else None
+
+        with get_read_cursor(self._paths.app_db_path) as cur:
+            cur.row_factory = None
+            cur.execute(_GET_MAPPING_SQL, (unified_name,) * 6)
+            mappings = self._collect_mappings(cur)
+        return mappings.get(unified_name)
+
+    @staticmethod
+    def _collect_mappings(rows) -> dict[str, dict]:
+        """把 UNION ALL 的判别行流组装成 {unified_name: mapping} 结构。
+
+        直接迭代游标：SQLite 按 step 逐行产出，不先在内存里堆全量行列表。
+        """
+        mappings: dict[str, dict] = {}
+        for sect, uname, c1, c2, c3, c4, _c5, _ord in rows:
+            if sect == 0:
+                mappings[uname] = {
+                    "unified_name": uname,
+                    "description": c1,
+                    "last_sync": c2,
+                    "order_index": c3,
+                    "enabled": bool(c4),
                     "rules": [],
                     "manual_includes": [],
                     "excluded_providers": [],
                     "resolved_models": {},
                     "model_settings": {},
                 }
-
-            # 2. Rules
-            cur.execute("SELECT unified_name, type, pattern, case_sensitive FROM model_mapping_rules ORDER BY order_index")
-            for r in cur.fetchall():
-                if r["unified_name"] in mappings:
-                    mappings[r["unified_name"]]["rules"].append({
-                        "type": r["type"],
-                        "pattern": r["pattern"],
-                        "case_sensitive": bool(r["case_sensitive"])
-                    })
-
-            # 3. Manual includes
-            cur.execute("SELECT unified_name, provider_id, model_id FROM model_mapping_manual_includes ORDER BY order_index")
-            for r in cur.fetchall():
-                if r["unified_name"] in mappings:
-                    ref = f"{r['provider_id']}:{r['model_id']}" if r["provider_id"] else r["model_id"]
-                    mappings[r["unified_name"]]["manual_includes"].append(ref)
-
-            # 4. Excluded providers
-            cur.execute("SELECT unified_name, provider_id FROM model_mapping_excluded_providers")
-            for r in cur.fetchall():
-                if r["unified_name"] in mappings:
-                    mappings[r["unified_name"]]["excluded_providers"].append(r["provider_id"])
-
-            # 5. Resolved models
-            cur.execute("SELECT unified_name, provider_id, model_id FROM model_mapping_resolved_models")
-            for r in cur.fetchall():
-                uname = r["unified_name"]
-                pid = r["provider_id"]
-                if uname in mappings:
-                    if pid not in mappings[uname]["resolved_models"]:
-                        mappings[uname]["resolved_models"][pid] = []
-                    mappings[uname]["resolved_models"][pid].append(r["model_id"])
-
-            # 6. Model settings
-            cur.execute("SELECT unified_name, provider_id, model_id, protocol, settings_json FROM model_mapping_model_settings")
-            for r in cur.fetchall():
-                uname = r["unified_name"]
-                if uname in mappings:
-                    key = f"{r['provider_id']}:{r['model_id']}"
-                    settings = json.loads(r["settings_json"] or "{}")
-                    if r["protocol"]:
-                        settings["protocol"] = r["protocol"]
-                    mappings[uname]["model_settings"][key] = settings
-
+                continue
+            mapping = mappings.get(uname)
+            if mapping is None:
+                continue
+            if sect == 1:  # rules: type, pattern, case_sensitive
+                mapping["rules"].append({"type": c1, "pattern": c2, "case_sensitive": bool(c3)})
+            elif sect == 2:  # manual includes: provider_id, model_id
+                mapping["manual_includes"].append(f"{c1}:{c2}" if c1 else c2)
+            elif sect == 3:  # excluded providers: provider_id
+                mapping["excluded_providers"].append(c1)
+            elif sect == 4:  # resolved models: provider_id, model_id
+                mapping["resolved_models"].setdefault(c1, []).append(c2)
+            else:  # model settings: provider_id, model_id, protocol, settings_json
+                settings = _json_loads(c4 or "{}")
+                if c3:
+                    settings["protocol"] = c3
+                mapping["model_settings"][f"{c1}:{c2}"] = settings
         return mappings
 
     def update_orders(self, ordered_names: list[str]) -> int:
         """Update order_index for all mappings based on the provided ordered list."""
         with get_db_cursor(self._paths.app_db_path) as cur:
-            updated = 0
-            for idx, name in enumerate(ordered_names):
-                cur.execute(
-                    "UPDATE model_mappings SET order_index = ? WHERE unified_name = ?",
-                    (idx, name)
-                )
-                updated += cur.rowcount
-            return updated
+            cur.executemany(
+                _SQL_UPDATE_ORDER,
+                list(enumerate(ordered_names)),
+            )
+            updated = cur.rowcount
+        self._invalidate_mappings_cache()
+        return updated
 
     def create_mapping(self, unified_name: str, description: str, enabled: bool = True) -> None:
         with get_db_cursor(self._paths.app_db_path) as cur:
@@ -1134,10 +1576,12 @@ class ModelMappingRepo:
                 "INSERT INTO model_mappings (unified_name, description, order_index, enabled) VALUES (?, ?, ?, ?)",
                 (unified_name, description, next_order, 1 if enabled else 0),
             )
+        self._invalidate_mappings_cache()
 
     def delete_mapping(self, unified_name: str) -> None:
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute("DELETE FROM model_mappings WHERE unified_name = ?", (unified_name,))
+        self._invalidate_mappings_cache()
 
     def update_mapping_meta(self, unified_name: str, description: Optional[str] = None, last_sync_ms: Optional[int] = None, enabled: Optional[bool] = None) -> None:
         updates = []
@@ -1156,123 +1600,164 @@ class ModelMappingRepo:
             with get_db_cursor(self._paths.app_db_path) as cur:
                 params.append(unified_name)
                 cur.execute(f"UPDATE model_mappings SET {', '.join(updates)} WHERE unified_name = ?", params)
+            self._invalidate_mappings_cache()
 
     def rename_mapping(self, old_name: str, new_name: str) -> None:
+        # 所有子表的 unified_name 外键都声明了 ON UPDATE CASCADE，
+        # 改主表一行即可级联更新，无需关外键逐表 UPDATE
         with get_db_cursor(self._paths.app_db_path) as cur:
-            # Disable foreign keys to allow update of PK if supported, or just use update cascade
-            # SQLite supports ON UPDATE CASCADE if defined in schema. 
-            # Our schema definitions in db.py don't have ON UPDATE CASCADE for unified_name FKs?
-            # Let's check db.py... It has ON DELETE CASCADE but not ON UPDATE CASCADE.
-            # So we might need to manually handle this or rely on deferrable constraints.
-            # Actually, standard practice in sqlite for renaming PK referenced by FKs without cascade update
-            # is tricky. 
-            # Easier approach: Insert new, Copy data, Delete old.
-            # But that's complex with many tables.
-            # Let's try PRAGMA foreign_keys = OFF temporarily.
-            
-            cur.execute("PRAGMA foreign_keys = OFF")
-            try:
-                cur.execute("UPDATE model_mappings SET unified_name = ? WHERE unified_name = ?", (new_name, old_name))
-                cur.execute("UPDATE model_mapping_rules SET unified_name = ? WHERE unified_name = ?", (new_name, old_name))
-                cur.execute("UPDATE model_mapping_manual_includes SET unified_name = ? WHERE unified_name = ?", (new_name, old_name))
-                cur.execute("UPDATE model_mapping_excluded_providers SET unified_name = ? WHERE unified_name = ?", (new_name, old_name))
-                cur.execute("UPDATE model_mapping_resolved_models SET unified_name = ? WHERE unified_name = ?", (new_name, old_name))
-                cur.execute("UPDATE model_mapping_model_settings SET unified_name = ? WHERE unified_name = ?", (new_name, old_name))
-                conn.commit()
-            finally:
-                cur.execute("PRAGMA foreign_keys = ON")
+            cur.execute(
+                "UPDATE model_mappings SET unified_name = ? WHERE unified_name = ?",
+                (new_name, old_name),
+            )
+        self._invalidate_mappings_cache()
 
     def replace_rules(self, unified_name: str, rules: list[dict]) -> None:
+        rows = [
+            (unified_name, r["type"], r["pattern"], 1 if r["case_sensitive"] else 0, idx)
+            for idx, r in enumerate(rules)
+        ]
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute("DELETE FROM model_mapping_rules WHERE unified_name = ?", (unified_name,))
-            for idx, r in enumerate(rules):
-                cur.execute(
-                    "INSERT INTO model_mapping_rules (unified_name, type, pattern, case_sensitive, order_index) VALUES (?, ?, ?, ?, ?)",
-                    (unified_name, r["type"], r["pattern"], 1 if r["case_sensitive"] else 0, idx)
-                )
+            cur.executemany(
+                _SQL_INSERT_RULE,
+                rows,
+            )
+        self._invalidate_mappings_cache()
 
     def replace_manual_includes(self, unified_name: str, includes: list[str]) -> None:
+        rows = []
+        for idx, ref in enumerate(includes):
+            pid, mid = None, ref
+            if ":" in ref:
+                pid, mid = ref.split(":", 1)
+            rows.append((unified_name, pid, mid, idx))
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute("DELETE FROM model_mapping_manual_includes WHERE unified_name = ?", (unified_name,))
-            for idx, ref in enumerate(includes):
-                pid, mid = None, ref
-                if ":" in ref:
-                    pid, mid = ref.split(":", 1)
-                cur.execute(
-                    "INSERT INTO model_mapping_manual_includes (unified_name, provider_id, model_id, order_index) VALUES (?, ?, ?, ?)",
-                    (unified_name, pid, mid, idx)
-                )
+            cur.executemany(
+                _SQL_INSERT_INCLUDE,
+                rows,
+            )
+        self._invalidate_mappings_cache()
 
     def replace_excluded_providers(self, unified_name: str, providers: list[str]) -> None:
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute("DELETE FROM model_mapping_excluded_providers WHERE unified_name = ?", (unified_name,))
-            for pid in providers:
-                cur.execute(
-                    "INSERT INTO model_mapping_excluded_providers (unified_name, provider_id) VALUES (?, ?)",
-                    (unified_name, pid)
-                )
+            cur.executemany(
+                _SQL_INSERT_EXCLUDED,
+                [(unified_name, pid) for pid in providers],
+            )
+        self._invalidate_mappings_cache()
 
     def replace_resolved_models(self, unified_name: str, resolved: dict[str, list[str]]) -> None:
+        # 展平成 (name, pid, mid) 批量插入；DELETE + executemany 同在一个事务里
+        rows = [(unified_name, pid, mid) for pid, models in resolved.items() for mid in models]
         with get_db_cursor(self._paths.app_db_path) as cur:
             cur.execute("DELETE FROM model_mapping_resolved_models WHERE unified_name = ?", (unified_name,))
-            for pid, models in resolved.items():
-                for mid in models:
-                    cur.execute(
-                        "INSERT INTO model_mapping_resolved_models (unified_name, provider_id, model_id) VALUES (?, ?, ?)",
-                        (unified_name, pid, mid)
-                    )
+            cur.executemany(
+                _SQL_INSERT_RESOLVED,
+                rows,
+            )
+        self._invalidate_mappings_cache()
 
     def update_model_settings(self, unified_name: str, settings: dict[str, dict]) -> None:
+        # The manager usually passes the full dict. 按行 UPSERT 而不是
+        # 全删全插：未变化的行不再产生 删除+重插 的 WAL 放大，
+        # 只有真正从 settings 中消失的键才会被删除。
+        rows = []
+        desired: set[tuple[str, str]] = set()
+        for key, s in settings.items():
+            if ":" not in key:
+                continue
+            pid, mid = key.split(":", 1)
+            desired.add((pid, mid))
+            rows.append((unified_name, pid, mid, s.get("protocol"), _json_dumps(s)))
         with get_db_cursor(self._paths.app_db_path) as cur:
-            # We can replace all settings for this mapping or upsert.
-            # The manager usually passes the full dict. Let's replace all to be safe and clean.
-            cur.execute("DELETE FROM model_mapping_model_settings WHERE unified_name = ?", (unified_name,))
-            for key, s in settings.items():
-                if ":" not in key:
-                    continue
-                pid, mid = key.split(":", 1)
-                protocol = s.get("protocol")
-                s_json = json.dumps(s, ensure_ascii=False)
-                cur.execute(
-                    "INSERT INTO model_mapping_model_settings (unified_name, provider_id, model_id, protocol, settings_json) VALUES (?, ?, ?, ?, ?)",
-                    (unified_name, pid, mid, protocol, s_json)
+            cur.execute(
+                "SELECT provider_id, model_id FROM model_mapping_model_settings WHERE unified_name = ?",
+                (unified_name,),
+            )
+            existing = {(r["provider_id"], r["model_id"]) for r in cur.fetchall()}
+            orphans = existing - desired
+            if orphans:
+                cur.executemany(
+                    "DELETE FROM model_mapping_model_settings WHERE unified_name = ? AND provider_id = ? AND model_id = ?",
+                    [(unified_name, pid, mid) for pid, mid in orphans],
                 )
+            cur.executemany(
+                _SQL_UPSERT_SETTING,
+                rows,
+            )
+        self._invalidate_mappings_cache()
 
     def set_model_protocol(self, unified_name: str, provider_id: str, model_id: str, protocol: Optional[str]) -> None:
-        with get_db_cursor(self._paths.app_db_path) as cur:
-            # First get existing settings
+        # 先读一眼当前值：重复设置同一协议时跳过整个写事务
+        # （也避免无谓的 list_mappings 缓存失效）
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute(
-                "SELECT settings_json FROM model_mapping_model_settings WHERE unified_name = ? AND provider_id = ? AND model_id = ?",
-                (unified_name, provider_id, model_id)
+                "SELECT protocol FROM model_mapping_model_settings WHERE unified_name = ? AND provider_id = ? AND model_id = ?",
+                (unified_name, provider_id, model_id),
             )
             row = cur.fetchone()
-            settings = json.loads(row["settings_json"]) if row else {}
-            
+        if row is None:
+            if protocol is None:
+                return
+        elif row["protocol"] == protocol:
+            return
+
+        # JSON 编辑下推给 json_set/json_remove，免去 SELECT + Python 改写 + 回写
+        with get_db_cursor(self._paths.app_db_path) as cur:
             if protocol is None:
-                if "protocol" in settings:
-                    del settings["protocol"]
-            else:
-                settings["protocol"] = protocol
-                
-            # If settings empty and protocol None, delete row? Or keep empty settings?
-            # If protocol is None and settings is empty, we can delete.
-            if not settings and protocol is None:
                 cur.execute(
-                    "DELETE FROM model_mapping_model_settings WHERE unified_name = ? AND provider_id = ? AND model_id = ?",
-                    (unified_name, provider_id, model_id)
+                    """
+                    UPDATE model_mapping_model_settings
+                    SET protocol = NULL,
+                        settings_json = json_remove(COALESCE(settings_json, '{}'), '$.protocol')
+                    WHERE unified_name = ? AND provider_id = ? AND model_id = ?
+                    """,
+                    (unified_name, provider_id, model_id),
+                )
+                # 摘掉 protocol 后没有任何剩余设置的行直接删除
+                cur.execute(
+                    """
+                    DELETE FROM model_mapping_model_settings
+                    WHERE unified_name = ? AND provider_id = ? AND model_id = ?
+                      AND protocol IS NULL AND settings_json = '{}'
+                    """,
+                    (unified_name, provider_id, model_id),
                 )
             else:
-                s_json = json.dumps(settings, ensure_ascii=False)
                 cur.execute(
                     """
                     INSERT INTO model_mapping_model_settings (unified_name, provider_id, model_id, protocol, settings_json)
-                    VALUES (?, ?, ?, ?, ?)
+                    VALUES (?, ?, ?, ?, json_object('protocol', ?))
                     ON CONFLICT(unified_name, provider_id, model_id) DO UPDATE SET
-                    protocol=excluded.protocol,
-                    settings_json=excluded.settings_json
+                      protocol = excluded.protocol,
+                      settings_json = json_set(COALESCE(settings_json, '{}'), '$.protocol', excluded.protocol)
                     """,
-                    (unified_name, provider_id, model_id, protocol, s_json)
+                    (unified_name, provider_id, model_id, protocol, protocol),
                 )
+        self._invalidate_mappings_cache()
+
+
+_UPSERT_HEALTH_SQL = """
+    INSERT INTO model_health_last (
+      provider_id, model_id, success, latency_ms, error, tested_at_ms, tested_at_iso, response_body_json
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(provider_id, model_id) DO UPDATE SET
+      success=excluded.success,
+      latency_ms=excluded.latency_ms,
+      error=excluded.error,
+      tested_at_ms=excluded.tested_at_ms,
+      tested_at_iso=excluded.tested_at_iso,
+      response_body_json=excluded.response_body_json
+"""
+
+
+def _ms_to_iso(ms: int) -> str:
+    """毫秒时间戳 → UTC ISO 串，不经过 datetime 对象（gmtime + strftime 更省）"""
+    s, msec = divmod(int(ms), 1000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(s)) + f".{msec:03d}+00:00"
 
 
 class ModelHealthRepo:
@@ -1283,34 +1768,35 @@ class ModelHealthRepo:
         """
         Returns {provider_id:model_id: {success, latency, ...}}
         """
-        with get_db_cursor(self._paths.app_db_path) as cur:
+        with get_read_cursor(self._paths.app_db_path) as cur:
             cur.execute(
                 """
-                SELECT provider_id, model_id, success, latency_ms, error, tested_at_ms, response_body_json
+                SELECT provider_id, model_id, success, latency_ms, error, tested_at_ms, tested_at_iso, response_body_json
                 FROM model_health_last
                 """
             )
-            rows = cur.fetchall()
 
-        results = {}
-        for r in rows:
-            key = f"{r['provider_id']}:{r['model_id']}"
-            # Convert ms timestamp back to ISO string for compatibility
-            tested_at_iso = datetime.fromtimestamp(r["tested_at_ms"] / 1000.0, timezone.utc).isoformat()
-            results[key] = {
-                "provider": r["provider_id"],
-                "model": r["model_id"],
-                "success": bool(r["success"]),
-                "latency_ms": r["latency_ms"],
-                "error": r["error"],
-                "tested_at": tested_at_iso,
-                "response_body": {},
-            }
-            try:
-                results[key]["response_body"] = json.loads(r["response_body_json"] or "{}")
-            except json.JSONDecodeError:
-                print(f"[WARN] Failed to decode response_body_json for {key}. Data might be corrupted.")
-                results[key]["response_body"] = {"error": "Failed to decode JSON body"}
+            # 直接迭代游标，逐行构建结果，不先物化全量行列表
+            results = {}
+            for r in cur:
+                key = f"{r['provider_id']}:{r['model_id']}"
+                # ISO 串写入时已物化；老行（NULL）回退现算
+                tested_at_iso = r["tested_at_iso"] or _ms_to_iso(r["tested_at_ms"])
+                results[key] = {
+                    "provider": r["provider_id"],
+                    "model": r["model_id"],
+                    "success": bool(r["success"]),
+                    "latency_ms": r["latency_ms"],
+                    "error": r["error"],
+                    "tested_at": tested_at_iso,
+                    "tested_at_ms": r["tested_at_ms"],
+                    "response_body": {},
+                }
+                try:
+                    results[key]["response_body"] = _json_loads(r["response_body_json"] or "{}")
+                except json.JSONDecodeError:
+                    print(f"[WARN] Failed to decode response_body_json for {key}. Data might be corrupted.")
+                    results[key]["response_body"] = {"error": "Failed to decode JSON body"}
         return results
 
     def upsert_result(self, result: dict) -> None:
@@ -1319,30 +1805,22 @@ class ModelHealthRepo:
         success = 1 if result["success"] else 0
         latency = result["latency_ms"]
         error = result.get("error")
-        body_json = json.dumps(result.get("response_body", {}), ensure_ascii=False)
+        body_json = _json_dumps(result.get("response_body", {}))
         
-        # Parse ISO timestamp to ms
-        try:
-            dt = datetime.fromisoformat(result["tested_at"].replace("Z", "+00:00"))
-            tested_at_ms = int(dt.timestamp() * 1000)
-        except:
-            tested_at_ms = _now_ms()
+        # 生产端（model_health）直接带毫秒整数；只有老数据路径才回退到解析 ISO 串
+        tested_at_ms = result.get("tested_at_ms")
+        if not tested_at_ms:
+            try:
+                dt = datetime.fromisoformat(result["tested_at"].replace("Z", "+00:00"))
+                tested_at_ms = int(dt.timestamp() * 1000)
+            except:
+                tested_at_ms = _now_ms()
+
+        # 写入时物化一次 ISO 串，省掉每次读取的逐行 datetime 换算
+        tested_at_iso = _ms_to_iso(tested_at_ms)
 
         with get_db_cursor(self._paths.app_db_path) as cur:
-            cur.execute(
-                """
-                INSERT INTO model_health_last (
-                  provider_id, model_id, success, latency_ms, error, tested_at_ms, response_body_json
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(provider_id, model_id) DO UPDATE SET
-                  success=excluded.success,
-                  latency_ms=excluded.latency_ms,
-                  error=excluded.error,
-                  tested_at_ms=excluded.tested_at_ms,
-                  response_body_json=excluded.response_body_json
-                """,
-                (pid, mid, success, latency, error, tested_at_ms, body_json)
-            )
+            cur.execute(_UPSERT_HEALTH_SQL, (pid, mid, success, latency, error, tested_at_ms, tested_at_iso, body_json))
 
     def delete_result(self, provider_id: str, model_id: str) -> None:
         with get_db_cursor(self._paths.app_db_path) as cur: